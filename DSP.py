@@ -1,18 +1,23 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
 import math
 import os
 import sys
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from PyQt5.QtCore import Qt, QSize, pyqtSignal, QPoint, QRegExp, QModelIndex, QTimer
-from PyQt5.QtGui import QIcon, QRegExpValidator
+from PyQt5.QtCore import Qt, QSize, pyqtSignal, QPoint, QRect, QRegExp, QModelIndex, QTimer, QAbstractTableModel
+from PyQt5.QtGui import QIcon, QPixmap, QColor, QFont, QKeySequence, QRegion, QRegExpValidator
 from PyQt5.QtWidgets import *
 
+from DSPCore import Thing, Formula, ThingsMgr, process_memory
+from DSPPack import PICTURES_BUNDLE, PictureBundle
+from DSPTrace import StallWatchdog, span, traced
+
 
 PICTURES_FOLDER = 'Pictures'
-FILES_FOLDER = "Files"
 
 
 STYLE_SHEET = '''
@@ -22,17 +27,13 @@ STYLE_SHEET = '''
     MainWindow {
         background-color: #222C3C;
     }
-    MPushButton, MTipsButton, RequirementTableItem {
+    MPushButton, MTipsButton {
         border: 0px;
     }
     TopButton:hover {
         border-radius: 5px;
         background-color: #33435b;
     }
-    ThingsTableItem {
-        border: 1px solid #030404;
-        background-color: #162226;
-    }
     ThingsTableWindow {
         gridline-color: #030404;
         background-color: #030404; 
@@ -97,10 +98,10 @@ STYLE_SHEET = '''
         border-radius: 5px;
         gridline-color: #415E68; 
     }
-    SettingsWidget, RequirementTableItem, RequirementTableWidget, RequirementPowerWidget {
+    SettingsWidget, RequirementTableWidget {
         background-color: transparent;
     }
-    CalculateWindow {
+    CalculateWindow, PlanWindow {
         background-color: #222C3C;
     }
     QHeaderView::section {
@@ -144,6 +145,7 @@ STYLE_SHEET = '''
 
 
 class MainWindow(QWidget):
+    @traced()
     def __init__(self, parent=None):
         super(MainWindow, self).__init__(parent)
         self.setWindowFlag(Qt.MSWindowsFixedSizeDialogHint, True)  # 窗体大小固定
@@ -152,6 +154,9 @@ class MainWindow(QWidget):
         self.btn_component = TopButton(self, '物品.png')
         self.btn_building = TopButton(self, '建筑.png')
         self.btn_other = TopButton(self, '杂项.png')
+        self.btn_plan = QPushButton('工厂规划', self)
+        self.btn_plan.setObjectName('TextButton')
+        self.btn_plan.setCursor(Qt.PointingHandCursor)
         self.wnd_components = ThingsTableWindow(self)
         self.wnd_buildings = ThingsTableWindow(self)
         self.wnd_others = ThingsTableWindow(self)
@@ -161,6 +166,7 @@ class MainWindow(QWidget):
         self.hbl_button.addWidget(self.btn_building)
         self.hbl_button.addWidget(self.btn_other)
         self.hbl_button.addStretch(1)
+        self.hbl_button.addWidget(self.btn_plan)
 
         self.vbl_main = QVBoxLayout()
         self.vbl_main.addLayout(self.hbl_button)
@@ -181,6 +187,11 @@ class MainWindow(QWidget):
         self.btn_component.clicked.connect(self.show_components)
         self.btn_building.clicked.connect(self.show_buildings)
         self.btn_other.clicked.connect(self.show_others)
+        self.btn_plan.clicked.connect(self.show_plan)
+
+        self.sct_memory_report = QShortcut(QKeySequence('Ctrl+Shift+M'), self)
+        self.sct_memory_report.setContext(Qt.ApplicationShortcut)
+        self.sct_memory_report.activated.connect(self.show_memory_report)
 
     def init_things_window(self):
         self.wnd_components.show_items(ThingsMgr.inst().components())
@@ -202,16 +213,115 @@ class MainWindow(QWidget):
         self.wnd_buildings.setVisible(False)
         self.wnd_others.setVisible(True)
 
+    def show_plan(self):
+        window = PlanWindow.inst()
+        window.show()
+        window.raise_()
+        window.activateWindow()
+
+    # Ctrl+Shift+M：显示计算窗体的数量和内存占用，用于检查关闭的窗体是否被释放
+    # 打包后的程序没有控制台，因此在对话框中显示，各窗体的详细信息在详细内容中
+    def show_memory_report(self):
+        report = CalculateWindow.memory_report()
+        details = []
+        for state in ('live', 'pooled'):
+            for info in report[state]:
+                details.append('%s #%d %s: %d widgets, %d rows, %.1f KB image' % (
+                    state, info['id'], info['thing'], info['widgets'], info['rows'], info['image'] / 1024))
+        process = report['process']
+        model = ThingsMgr.inst().memory_report()
+        lines = [
+            'windows: %d live, %d pooled, %d instances; %d widgets, %.1f MB image; process %s' % (
+                len(report['live']), len(report['pooled']), report['instances'], report['widgets'],
+                report['image'] / 1024 / 1024, '%.1f MB' % (process / 1024 / 1024) if process else 'unknown'),
+            'model: things %.1f KB, formulas %.1f KB, graph %.1f KB, total %.1f KB' % (
+                model['things'] / 1024, model['formulas'] / 1024, model['graph'] / 1024, model['total'] / 1024),
+        ]
+
+        box = QMessageBox(QMessageBox.Information, '内存占用', '\n'.join(lines), QMessageBox.Ok, self)
+        box.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        if details:
+            box.setDetailedText('\n'.join(details))
+        box.exec_()
+
     def closeEvent(self, event):
         sys.exit()
 
 
+# 图标缓存，每张图片只从磁盘读取一次，并按(图片, 尺寸)保存缩放好的图标
+# 占用内存超过memory_limit时淘汰最久未使用的图片
+# 存在打包好的图片包（见DSPPack.py）且与图片文件夹一致时从图片包读取，否则读取图片文件夹中的文件
+class IconCache(object):
+    _inst = None
+    memory_limit = 32 * 1024 * 1024
+
+    def __init__(self, bundle=PICTURES_BUNDLE):
+        self._bundle = PictureBundle.open(bundle, PICTURES_FOLDER)
+        self._pixmaps = OrderedDict()   # {(图片, 宽, 高): (QIcon或QPixmap, 字节数)}，宽高为0表示原图
+        self._memory = 0
+        self.hits = 0
+        self.misses = 0
+
+    def icon(self, picture, size):
+        key = (picture or '', size.width(), size.height())
+        data = self._pixmaps.get(key)
+        if data is not None:
+            self._pixmaps.move_to_end(key)
+            self.hits += 1
+            return data[0]
+
+        self.misses += 1
+        with span('IconCache.icon', picture=key[0], width=key[1], height=key[2]):
+            pixmap = self.pixmap(picture)
+            if not pixmap.isNull():
+                pixmap = pixmap.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            icon = QIcon(pixmap)
+        self.add(key, icon, pixmap)
+        return icon
+
+    # 磁盘上的原图
+    def pixmap(self, picture):
+        key = (picture or '', 0, 0)
+        data = self._pixmaps.get(key)
+        if data is not None:
+            self._pixmaps.move_to_end(key)
+            return data[0]
+
+        with span('IconCache.load', picture=key[0]):
+            pixmap = QPixmap()
+            data = self._bundle.data(picture) if self._bundle and picture else None
+            if data is not None:
+                pixmap.loadFromData(data)
+            elif picture:
+                pixmap.load(os.path.join(PICTURES_FOLDER, picture))
+        self.add(key, pixmap, pixmap)
+        return pixmap
+
+    def add(self, key, value, pixmap):
+        size = pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+        self._pixmaps[key] = (value, size)
+        self._memory += size
+        while self._memory > self.memory_limit and len(self._pixmaps) > 1:
+            old_value, old_size = self._pixmaps.popitem(last=False)[1]
+            self._memory -= old_size
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'count': len(self._pixmaps), 'memory': self._memory,
+                'bundle': self._bundle is not None}
+
+    @classmethod
+    def inst(cls):
+        if cls._inst is None:
+            cls._inst = cls()
+        return cls._inst
+
+
 class MPushButton(QPushButton):
     def __init__(self, parent=None):
         super(MPushButton, self).__init__(parent)
 
     def set_icon(self, picture):
-        self.setIcon(QIcon(os.path.join(PICTURES_FOLDER, picture or '')))
+        self.setIcon(IconCache.inst().icon(picture, self.iconSize()))
 
 
 class MTipsButton(QPushButton):
@@ -232,7 +342,7 @@ class MTipsButton(QPushButton):
         self._count = count
 
     def set_icon(self, picture):
-        self.setIcon(QIcon(os.path.join(PICTURES_FOLDER, picture or '')))
+        self.setIcon(IconCache.inst().icon(picture, self.iconSize()))
 
     def disableTooltips(self, can):
         self._can_tips = can
@@ -263,27 +373,6 @@ class MTipsButton(QPushButton):
         super(MTipsButton, self).mouseReleaseEvent(event)
 
 
-class MTableWidget(QTableWidget):
-    def __init__(self, parent=None):
-        super(MTableWidget, self).__init__(parent)
-        self.setShowGrid(False)
-        self.horizontalHeader().setVisible(False)  # 行列表头不显示
-        self.verticalHeader().setVisible(False)
-        self.horizontalHeader().setSectionsClickable(False)  # 表头不可点击
-        self.verticalHeader().setSectionsClickable(False)
-        self.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)  # 自动大小
-        self.verticalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
-        self.setEditTriggers(QAbstractItemView.NoEditTriggers)  # 不可编辑
-        self.setSelectionMode(QAbstractItemView.NoSelection)  # 不可选中
-        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContents)
-
-    def set_min_section(self, size):
-        self.horizontalHeader().setMinimumSectionSize(size.width())
-        self.verticalHeader().setMinimumSectionSize(size.height())
-
-
 # 悬浮提示框中的分割线
 class MHLine1(QFrame):
     line_style = '''
@@ -333,45 +422,165 @@ class TopButton(MPushButton):
         self.set_icon(picture)
 
 
-# 主窗体中的物品表格单元
-class ThingsTableItem(MTipsButton):
+# 主窗体中物品表格的数据，按物品的行列位置保存物品
+class ThingsTableModel(QAbstractTableModel):
+    row_count = 8
+    col_count = 14
+
+    def __init__(self, parent=None):
+        super(ThingsTableModel, self).__init__(parent)
+        self._things = {}       # {(row, col): thing}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.col_count
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.UserRole:
+            return self.thing(index)
+        return None
+
+    def thing(self, index):
+        if not index.isValid():
+            return None
+        return self._things.get((index.row(), index.column()))
+
+    def set_things(self, data):
+        self.beginResetModel()
+        self._things = {}
+        for name, thing in data.items():
+            if thing.row >= 0 and thing.col >= 0:
+                self._things[(thing.row, thing.col)] = thing
+        self.endResetModel()
+
+
+# 主窗体中物品表格单元的绘制
+class ThingsTableDelegate(QStyledItemDelegate):
     size = QSize(60, 60)
     image_size = QSize(50, 50)
+    border_color = QColor('#030404')
+    background_color = QColor('#162226')
+
+    def paint(self, painter, option, index):
+        painter.fillRect(option.rect, self.border_color)
+        painter.fillRect(option.rect.adjusted(1, 1, -1, -1), self.background_color)
+        thing = index.data(Qt.UserRole)
+        if thing:
+            rect = QRect(QPoint(0, 0), self.image_size)
+            rect.moveCenter(option.rect.center())
+            IconCache.inst().icon(thing.icon, self.image_size).paint(painter, rect)
+
+    def sizeHint(self, option, index):
+        return self.size
+
+
+# 通过模型显示物品的表格，鼠标悬浮在物品上时显示提示框，左键点击物品，右键显示相关公式
+class MTableView(QTableView):
+    hand_cursor = False
 
     def __init__(self, parent=None):
-        super(ThingsTableItem, self).__init__(parent)
-        self.setFixedSize(self.size)
-        self.setIconSize(self.image_size)
-        self.clicked.connect(self.open_calculation)
+        super(MTableView, self).__init__(parent)
+        self._hover = None          # (thing, rect, count)
+        self._pressed = None
+        self.right_pressed = False
+        self.setShowGrid(False)
+        self.horizontalHeader().setVisible(False)  # 行列表头不显示
+        self.verticalHeader().setVisible(False)
+        self.horizontalHeader().setSectionsClickable(False)  # 表头不可点击
+        self.verticalHeader().setSectionsClickable(False)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)  # 不可编辑
+        self.setSelectionMode(QAbstractItemView.NoSelection)  # 不可选中
+        self.setFocusPolicy(Qt.NoFocus)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContents)
+        self.setMouseTracking(True)
+
+    def set_section_size(self, size):
+        self.horizontalHeader().setMinimumSectionSize(size.width())
+        self.verticalHeader().setMinimumSectionSize(size.height())
+        self.horizontalHeader().setDefaultSectionSize(size.width())
+        self.verticalHeader().setDefaultSectionSize(size.height())
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+
+    # 返回pos（viewport坐标）处的(thing, rect, count)，没有物品时返回None
+    def thing_at(self, pos):
+        index = self.indexAt(pos)
+        thing = index.data(Qt.UserRole)
+        if not isinstance(thing, Thing):
+            return None
+        return thing, self.visualRect(index), None
+
+    def thing_clicked(self, thing, count):
+        pass
+
+    # 悬浮提示框中显示的数量
+    def count_text(self, count):
+        return count
+
+    def tooltip_pos(self, rect):
+        return self.viewport().mapToGlobal(QPoint(rect.left() + rect.width() // 2, rect.top() + rect.height() + 5))
+
+    def update_hover(self, pos):
+        hover = self.thing_at(pos)
+        if hover == self._hover:
+            return
+        ThingTooltipWindow.inst().on_hide()
+        self._hover = hover
+        if hover:
+            thing, rect, count = hover
+            ThingTooltipWindow.inst().delay_show(thing, self.tooltip_pos(rect), self.count_text(count))
+        if self.hand_cursor:
+            self.viewport().setCursor(Qt.PointingHandCursor if hover else Qt.ArrowCursor)
 
-    def open_calculation(self):
-        if self._thing and self._thing.product_formulas():
-            CalculateWindow.new_window(self._thing)
+    def mouseMoveEvent(self, event):
+        super(MTableView, self).mouseMoveEvent(event)
+        self.update_hover(event.pos())
+
+    def leaveEvent(self, event):
+        super(MTableView, self).leaveEvent(event)
+        self._hover = None
+        ThingTooltipWindow.inst().on_hide()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.RightButton:
+            self.right_pressed = True
+        elif event.button() == Qt.LeftButton:
+            self._pressed = self.thing_at(event.pos())
+        super(MTableView, self).mousePressEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        target = self.thing_at(event.pos())
+        if event.button() == Qt.LeftButton and target and target == self._pressed:
+            ThingTooltipWindow.inst().on_hide()
+            self.thing_clicked(target[0], target[2])
+        elif event.button() == Qt.RightButton and self.right_pressed and target:
+            ThingTooltipWindow.inst().show_relevant_formula(target[0], self.tooltip_pos(target[1]))
+        self._pressed = None
+        self.right_pressed = False
+        super(MTableView, self).mouseReleaseEvent(event)
 
 
 # 主窗体中的物品表格
-class ThingsTableWindow(MTableWidget):
+class ThingsTableWindow(MTableView):
+    hand_cursor = True
+
     def __init__(self, parent=None):
         super(ThingsTableWindow, self).__init__(parent)
-        self.set_min_section(ThingsTableItem.size)
-        self.init_items()
-
-    def init_items(self):
-        self.setRowCount(8)
-        self.setColumnCount(14)
-        for row in range(self.rowCount()):
-            for col in range(self.columnCount()):
-                item = ThingsTableItem()
-                self.setCellWidget(row, col, item)
-        self.horizontalHeader().resizeSections()
+        self.setModel(ThingsTableModel(self))
+        self.setItemDelegate(ThingsTableDelegate(self))
+        self.set_section_size(ThingsTableDelegate.size)
         self.resize(self.sizeHint())
 
     def show_items(self, data):
-        for name, thing in data.items():
-            if thing.row >= 0 and thing.col >= 0:
-                item = self.cellWidget(thing.row, thing.col)
-                item.set_thing(thing)
-                item.setCursor(Qt.PointingHandCursor)
+        self.model().set_things(data)
+
+    def thing_clicked(self, thing, count):
+        if thing.product_formulas():
+            CalculateWindow.new_window(thing)
 
 
 # 计算窗体中选择使用公式的选择框的下拉列表
@@ -410,7 +619,6 @@ class FormulaSelectWidget(QComboBox):
         self.hbl_widget.setContentsMargins(0, 0, 18, 0)
         self.list_widget.itemClicked.connect(self.on_select)
 
-        self.list_widget.add_formulas(self._thing.product_formulas())
         for formula in self._thing.product_formulas():
             item = FormulaWidget(formula, True)
             item.clicked.connect(self.showPopup)
@@ -421,6 +629,13 @@ class FormulaSelectWidget(QComboBox):
     def save_current_selected(self):
         self._thing.set_selected_formula(self._current_formula)
 
+    # 下拉列表中的公式在第一次弹出时才创建
+    def showPopup(self):
+        if self.list_widget.count() == 0:
+            self.list_widget.add_formulas(self._thing.product_formulas())
+            self.setCurrentIndex(self._thing.product_formulas().index(self._current_formula))
+        super(FormulaSelectWidget, self).showPopup()
+
     def show_item(self, formula):
         if formula is None or self._current_formula == formula:
             return
@@ -430,7 +645,8 @@ class FormulaSelectWidget(QComboBox):
             item = self.vbl_widget.itemAt(i).widget()
             if item.formula() == formula:
                 item.setVisible(True)
-                self.setCurrentIndex(i)
+                if self.list_widget.count() > i:
+                    self.setCurrentIndex(i)
             else:
                 item.setVisible(False)
 
@@ -448,9 +664,14 @@ class FormulaSelectWidget(QComboBox):
 
 
 # 计算窗体中的设置部分
+# 设置保存在Formula和物品中，所有计算窗体共用一个设置组件，第一次显示设置时才创建，显示在哪个窗体中就属于哪个窗体
 class SettingsWidget(QWidget):
+    _inst = None
+
+    @traced()
     def __init__(self, parent=None):
         super(SettingsWidget, self).__init__(parent)
+        self.owner = None
         self._select_facility_widget = []
         self._select_formula_widget = []
         self.lbl_mineral_utilization = QLabel('矿物利用等级：', self)
@@ -534,231 +755,334 @@ class SettingsWidget(QWidget):
         for select_wdg in self._select_formula_widget:
             select_wdg.save_current_selected()
 
+    # 把设置组件移到另一个窗体中，原来的窗体收起设置
+    def attach(self, window):
+        owner = self.owner
+        self.owner = window
+        window.vbl_widget.insertWidget(1, self)      # 顶栏和计算结果之间
+        self.setVisible(True)
+        if owner is not None and owner is not window:
+            owner.settings_detached()
+
+    def detach(self, window):
+        if self.owner is window:
+            self.owner = None
+            self.setVisible(False)
+            self.setParent(None)
+
+    # 设置组件还没有创建时Formula中的设置就是当前设置，不需要保存
+    @classmethod
+    def activate(cls):
+        if cls._inst is not None:
+            cls._inst.activate_settings()
 
-# 显示计算结果的表格单元中的单个物品
-class RequirementThingWidget(QWidget):
-    size = QSize(60, 50)
-    image_size = QSize(38, 38)
-    value_style = '''
-        QLabel {
-            color: #99FFFF; 
-            font-size: 12px; 
-            qproperty-alignment: "AlignHCenter | AlignBottom";
-        }
-    '''
+    @classmethod
+    def inst(cls):
+        if cls._inst is None:
+            cls._inst = cls()
+        return cls._inst
 
-    def __init__(self, thing, count, parent=None):
-        super(RequirementThingWidget, self).__init__(parent)
-        self.setFixedSize(self.size)
-        self._thing = thing
-        self._count = count
-        self.btn_image = MTipsButton(self)
-        self.lbl_value = QLabel(self)
-        count_text = '%.2f' % count if count >= 0 else '不定'
-        self.lbl_value.setStyleSheet(self.value_style)
-        self.lbl_value.setText(count_text)
-        self.btn_image.setFixedSize(self.image_size)
-        self.btn_image.setIconSize(self.image_size)
-        self.btn_image.set_thing(thing)
-        self.btn_image.set_count(count_text)
 
-        self.hbl_widget = QHBoxLayout()
-        self.hbl_widget.setSpacing(0)
-        self.hbl_widget.addStretch(1)
-        self.hbl_widget.addWidget(self.btn_image)
-        self.hbl_widget.addStretch(1)
-        self.hbl_widget.setContentsMargins(0, 0, 0, 0)
+# 显示计算结果的表格数据，每行为一个需求，每列为物品列表或工作功率
+class RequirementTableModel(QAbstractTableModel):
+    def __init__(self, columns, parent=None):
+        super(RequirementTableModel, self).__init__(parent)
+        self._columns = columns     # [(表头, Requirement的方法, 每行显示的物品数), ...]，物品数为0表示功率列
+        self._rows = []
 
-        self.vbl_widget = QVBoxLayout(self)
-        self.vbl_widget.setSpacing(0)
-        self.vbl_widget.addLayout(self.hbl_widget)
-        self.vbl_widget.addWidget(self.lbl_value)
-        self.vbl_widget.setContentsMargins(0, 0, 0, 0)
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
 
-        self.btn_image.clicked.connect(self.open_calculation)
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._columns)
 
-    def open_calculation(self):
-        if self._thing and self._thing.product_formulas():
-            CalculateWindow.new_window(self._thing, round(self._count, 2))
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self._columns[section][0]
+        return None
 
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.UserRole and index.isValid():
+            return self._rows[index.row()][index.column()]
+        return None
 
-# 显示计算结果的表格单元，显示物品列表
-class RequirementTableItem(MTableWidget):
-    def __init__(self, col_count, data, parent=None):
-        super(RequirementTableItem, self).__init__(parent)
-        row_count = math.ceil(len(data) / col_count) or 1
-        self.setRowCount(row_count)
-        self.setColumnCount(col_count)
-        self.set_min_section(RequirementThingWidget.size)
-        row = 0
-        col = 0
-        for name, value in data:
-            thing = ThingsMgr.inst().get_thing(name)
-            item = RequirementThingWidget(thing, value)
-            self.setCellWidget(row, col, item)
-            col += 1
-            if col >= col_count:
-                row += 1
-                col = 0
-        self.horizontalHeader().resizeSections()
-        self.resize(self.sizeHint())
+    def items_per_row(self, column):
+        return self._columns[column][2]
+
+    # 单元格中物品的行数
+    def item_lines(self, row):
+        lines = 1
+        for column, (title, method, per_row) in enumerate(self._columns):
+            if per_row:
+                lines = max(lines, math.ceil(len(self._rows[row][column]) / per_row))
+        return lines
+
+    # 行数不变时只更新内容有变化的行，返回这些行的序号；行数改变时重置模型，返回None
+    def set_requirements(self, requirements):
+        rows = [self.row_data(req) for req in requirements]
+        if len(rows) != len(self._rows):
+            self.beginResetModel()
+            self._rows = rows
+            self.endResetModel()
+            return None
 
-    def currentChanged(self, *event):
-        self.setCurrentIndex(QModelIndex())
+        changed = [row for row in range(len(rows)) if rows[row] != self._rows[row]]
+        for row in changed:
+            self._rows[row] = rows[row]
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self._columns) - 1))
+        return changed
+
+    def row_data(self, req):
+        data = []
+        for title, method, per_row in self._columns:
+            value = getattr(req, method)()
+            if per_row:
+                value = [(ThingsMgr.inst().get_thing(name), count) for name, count in value]
+            data.append(value)
+        return data
+
+
+# 显示计算结果的表格单元的绘制，物品按每行per_row个排列，图标下方显示数量
+class RequirementDelegate(QStyledItemDelegate):
+    item_size = QSize(60, 50)
+    image_size = QSize(38, 38)
+    value_color = QColor('#99FFFF')
 
+    def paint(self, painter, option, index):
+        value = index.data(Qt.UserRole)
+        if not value:
+            return
+        per_row = index.model().items_per_row(index.column())
+        painter.save()
+        painter.setPen(self.value_color)
+        font = QFont(option.font)
+        if per_row:
+            font.setPixelSize(12)
+            painter.setFont(font)
+            for pos, (thing, count) in enumerate(value):
+                rect = self.item_rect(option.rect, pos, per_row)
+                if thing:
+                    IconCache.inst().icon(thing.icon, self.image_size).paint(painter, self.image_rect(rect))
+                painter.drawText(rect, Qt.AlignHCenter | Qt.AlignBottom, self.count_text(count))
+        else:
+            font.setPointSize(9)
+            painter.setFont(font)
+            painter.drawText(option.rect, Qt.AlignCenter, trans_power(value))
+        painter.restore()
 
-# 显示计算结果的表格单元，显示功率
-class RequirementPowerWidget(QWidget):
-    style_sheet = '''
-        QLabel {
-            color: #99FFFF;
-            font-size: 9pt;
-            qproperty-alignment: "AlignCenter";
-        }
-    '''
+    @classmethod
+    def item_rect(cls, cell_rect, pos, per_row):
+        return QRect(cell_rect.left() + (pos % per_row) * cls.item_size.width(),
+                     cell_rect.top() + (pos // per_row) * cls.item_size.height(),
+                     cls.item_size.width(), cls.item_size.height())
 
-    def __init__(self, power, parent=None):
-        super(RequirementPowerWidget, self).__init__(parent)
-        self.setStyleSheet(self.style_sheet)
-        self.lbl_power = QLabel(trans_power(power), self)
-        self.vbl_widget = QVBoxLayout(self)
-        self.vbl_widget.addWidget(self.lbl_power)
-        self.resize(self.vbl_widget.sizeHint())
+    @classmethod
+    def image_rect(cls, item_rect):
+        left = item_rect.left() + (item_rect.width() - cls.image_size.width()) // 2
+        return QRect(QPoint(left, item_rect.top()), cls.image_size)
+
+    @staticmethod
+    def count_text(count):
+        return '%.2f' % count if count >= 0 else '不定'
 
 
-# 显示计算结果的表格
-class RequirementTableWidget(MTableWidget):
+# 显示计算结果的表格，只绘制可见的行
+class RequirementTableWidget(MTableView):
+    columns = []
+    visible_rows = 10
+    power_width = 93
+
     def __init__(self, parent=None):
         super(RequirementTableWidget, self).__init__(parent)
         self.setShowGrid(True)
         self.horizontalHeader().setVisible(True)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
-        self.set_min_section(RequirementThingWidget.size)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setSizeAdjustPolicy(QAbstractScrollArea.AdjustIgnored)
+        self.setModel(RequirementTableModel(self.columns, self))
+        self.setItemDelegate(RequirementDelegate(self))
+        self.set_section_size(RequirementDelegate.item_size)
+
+        # 网格线占用单元格的1像素
+        width = 0
+        for column, (title, method, per_row) in enumerate(self.columns):
+            column_width = per_row * RequirementDelegate.item_size.width() + 1 if per_row else self.power_width
+            self.setColumnWidth(column, column_width)
+            width += column_width
+        self.horizontalHeader().setStretchLastSection(True)
+        width += self.frameWidth() * 2 + self.verticalScrollBar().sizeHint().width()
+        height = self.horizontalHeader().sizeHint().height() + self.frameWidth() * 2 + \
+            self.visible_rows * RequirementDelegate.item_size.height() + 1
+        self.setFixedSize(width, height)
 
-    def show_things(self, things, row, col, col_count):
-        if things:
-            table_widget = RequirementTableItem(col_count, things)
-            self.setCellWidget(row, col, table_widget)
+    def show_requirements(self, requirements):
+        with span('%s.show_requirements' % type(self).__name__, rows=len(requirements)) as current:
+            model = self.model()
+            changed = model.set_requirements(requirements)
+            current.set(changed=model.rowCount() if changed is None else len(changed))
+            for row in range(model.rowCount()) if changed is None else changed:
+                self.setRowHeight(row, model.item_lines(row) * RequirementDelegate.item_size.height() + 1)
+
+    def thing_at(self, pos):
+        index = self.indexAt(pos)
+        if not index.isValid():
+            return None
+        per_row = self.model().items_per_row(index.column())
+        items = index.data(Qt.UserRole)
+        if not per_row or not items:
+            return None
 
-    def show_power(self, power, row, col):
-        if power:
-            widget = RequirementPowerWidget(power)
-            self.setCellWidget(row, col, widget)
+        cell_rect = self.visualRect(index)
+        col = (pos.x() - cell_rect.left()) // RequirementDelegate.item_size.width()
+        line = (pos.y() - cell_rect.top()) // RequirementDelegate.item_size.height()
+        pos_in_cell = line * per_row + col
+        if col >= per_row or pos_in_cell >= len(items):
+            return None
+        rect = RequirementDelegate.image_rect(RequirementDelegate.item_rect(cell_rect, pos_in_cell, per_row))
+        thing, count = items[pos_in_cell]
+        if thing is None or not rect.contains(pos):
+            return None
+        return thing, rect, count
 
+    def count_text(self, count):
+        return RequirementDelegate.count_text(count)
 
-class RequirementTableFour(RequirementTableWidget):
-    material_count = 6
-    facility_count = 5
-    byproduct_count = 1
+    def thing_clicked(self, thing, count):
+        if thing.product_formulas():
+            CalculateWindow.new_window(thing, round(count, 2))
 
-    def __init__(self, parent=None):
-        super(RequirementTableFour, self).__init__(parent)
-        self.setColumnCount(4)
-        self.setHorizontalHeaderLabels(('所需原料', '所需设备', '副产物', '工作功率'))
-        self.setRowCount(10)
-        self.setCellWidget(0, 0, RequirementTableItem(self.material_count, []))
-        self.setCellWidget(0, 1, RequirementTableItem(self.facility_count, []))
-        self.setCellWidget(0, 2, RequirementTableItem(self.byproduct_count, []))
-        self.setCellWidget(0, 3, RequirementPowerWidget(99999))
-        self.horizontalHeader().resizeSections()
-        self.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
-        self.horizontalHeader().setStretchLastSection(True)
-        self.setFixedSize(self.sizeHint())
-        self.setRowCount(0)
 
-    def show_requirements(self, requirements):
-        self.setRowCount(len(requirements))
-        row_index = 0
-        for req in requirements:
-            self.show_things(req.materials_list(), row_index, 0, self.material_count)
-            self.show_things(req.facilities(), row_index, 1, self.facility_count)
-            self.show_things(req.byproducts_list(), row_index, 2, self.byproduct_count)
-            self.show_power(req.work_consumption(), row_index, 3)
-            row_index += 1
-        self.horizontalHeader().resizeSections()
+class RequirementTableFour(RequirementTableWidget):
+    columns = [
+        ('所需原料', 'materials_list', 6),
+        ('所需设备', 'facilities', 5),
+        ('副产物', 'byproducts_list', 1),
+        ('工作功率', 'work_consumption', 0),
+    ]
 
 
 class RequirementTableFive(RequirementTableWidget):
-    product_count = 1
-    material_count = 5
-    facility_count = 5
-    byproduct_count = 1
+    columns = [
+        ('产物', 'product_list', 1),
+        ('所需原料', 'materials_list', 5),
+        ('所需设备', 'facilities', 5),
+        ('副产物', 'byproducts_list', 1),
+        ('工作功率', 'work_consumption', 0),
+    ]
 
-    def __init__(self, parent=None):
-        super(RequirementTableFive, self).__init__(parent)
-        self.setColumnCount(5)
-        self.setHorizontalHeaderLabels(('产物', '所需原料', '所需设备', '副产物', '工作功率'))
-        self.setRowCount(10)
-        self.setCellWidget(0, 0, RequirementTableItem(self.product_count, []))
-        self.setCellWidget(0, 1, RequirementTableItem(self.material_count, []))
-        self.setCellWidget(0, 2, RequirementTableItem(self.facility_count, []))
-        self.setCellWidget(0, 3, RequirementTableItem(self.byproduct_count, []))
-        self.setCellWidget(0, 4, RequirementPowerWidget(99999))
-        self.horizontalHeader().resizeSections()
-        self.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
-        self.horizontalHeader().setStretchLastSection(True)
-        self.setFixedSize(self.sizeHint())
-        self.setRowCount(0)
 
-    def show_requirements(self, requirements):
-        self.setRowCount(len(requirements))
-        row_index = 0
-        for req in requirements:
-            self.show_things(req.product_list(), row_index, 0, self.product_count)
-            self.show_things(req.materials_list(), row_index, 1, self.material_count)
-            self.show_things(req.facilities(), row_index, 2, self.facility_count)
-            self.show_things(req.byproducts_list(), row_index, 3, self.byproduct_count)
-            self.show_power(req.work_consumption(), row_index, 4)
-            row_index += 1
-        self.horizontalHeader().resizeSections()
+# 计算窗体
+# 后台线程中的计算任务，计算每分钟1个产物的需求，结果通过窗体的calculate_finished信号回到界面线程
+# 使用计算开始时的设置快照，计算过程中修改设置不会影响结果；任务取消后不再发出信号
+class CalculateTask(object):
+    max_workers = 2
+    _executor = None
+
+    def __init__(self, window, thing, speed, settings):
+        self.window = window
+        self.thing = thing
+        self.speed = speed
+        self.settings = settings
+        self.cancelled = False
+        self._future = None
+
+    def start(self):
+        if CalculateTask._executor is None:
+            CalculateTask._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='calculate')
+        self._future = CalculateTask._executor.submit(self.run)
+
+    # 还没有开始的任务直接移出队列，正在计算的任务在计算完成后丢弃结果
+    def cancel(self):
+        self.cancelled = True
+        if self._future is not None:
+            self._future.cancel()
+
+    def calculate(self):
+        return ThingsMgr.inst().calcu_requirements(self.thing, 1, settings=self.settings)
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            results = self.calculate()
+        except Exception as error:
+            self.emit('calculate_failed', str(error))
+            return
+        results, results2 = results or ([], [])
+        self.emit('calculate_finished', results, results2)
 
+    def emit(self, signal, *args):
+        if self.cancelled:
+            return
+        try:
+            getattr(self.window, signal).emit(self, *args)
+        except RuntimeError:
+            pass    # 窗体已经释放
 
-# 计算窗体
+
+# 关闭的计算窗体最多保留pool_size个，打开新窗体时换成新的物品重复使用，超出的窗体直接释放
 class CalculateWindow(QDialog):
+    calculate_finished = pyqtSignal(object, object, object)     # 任务, 各层需求, 各产物需求
+    calculate_failed = pyqtSignal(object, str)
+    live_delay = 300        # 实时计算时停止输入多少毫秒后开始计算
     win_id = 0
-    all_windows = {}
+    all_windows = {}        # {窗体编号: 打开中的窗体}
+    pool_size = 4
+    _pool = []
+    _instances = weakref.WeakSet()  # 所有还没有被回收的窗体，用于检查关闭的窗体是否真正释放
     style_sheet = '''
          QLabel {
             color: #989898;
             font-size: 9pt;
             qproperty-alignment: "AlignCenter";
         }
+        QCheckBox {
+            color: #989898;
+            font-size: 9pt;
+        }
     '''
 
+    @traced()
     def __init__(self, thing, value, parent=None):
         super(CalculateWindow, self).__init__(parent)
         self._thing = thing
+        self._task = None
+        self._unit_results = None   # (设置指纹, 各层需求, 各产物需求)，都是每分钟1个产物的需求
         self.w_id = self.win_id
+        self._instances.add(self)
 
         self.setWindowFlag(Qt.WindowContextHelpButtonHint, False)  # 无帮助按钮
         self.setWindowFlag(Qt.MSWindowsFixedSizeDialogHint, True)  # 窗体大小固定
         self.setStyleSheet(self.style_sheet)
-        self.setWindowTitle(thing.name)
-        self.setWindowIcon(QIcon(os.path.join(PICTURES_FOLDER, thing.icon)))
 
         self.btn_product = MTipsButton(self)
-        self.btn_product.set_thing(thing)
+        self.btn_product.setFixedSize(QSize(50, 50))
+        self.btn_product.setIconSize(QSize(50, 50))
         self.lbl_unit = QLabel('/min', self)
         self.ldt_production_speed = QLineEdit(self)
-        self.ldt_production_speed.setText(str(value))
         self.btn_calculate = QPushButton('计算', self)
         self.btn_calculate.setObjectName('TextButton')
+        self.chk_live_calculate = QCheckBox('实时计算', self)
+        self.chk_live_calculate.setToolTip('修改产量后自动计算')
+        self.timer_live_calculate = QTimer(self)
+        self.timer_live_calculate.setSingleShot(True)
+        self.timer_live_calculate.setInterval(self.live_delay)
+        self.btn_add_plan = QPushButton('加入规划', self)
+        self.btn_add_plan.setObjectName('TextButton')
         self.btn_settings = QPushButton('隐藏设置', self)
         self.btn_settings.setObjectName('TextButton')
         self.btn_switch_table = QPushButton('切换表格', self)
         self.btn_switch_table.setObjectName('TextButton')
 
-        self.wgt_settings = SettingsWidget(self)
         self.wgt_requirements = QWidget(self)
         self.tbw_current_requirement_table = RequirementTableFour(self)
         self.tbw_different_requirement_table = RequirementTableFive(self)
 
-        self.btn_product.setFixedSize(QSize(50, 50))
-        self.btn_product.setIconSize(QSize(50, 50))
         self.ldt_production_speed.setFixedWidth(60)
         self.ldt_production_speed.setValidator(QRegExpValidator(QRegExp(r"[0-9]+.[0-9]+")))
         self.btn_calculate.setDefault(True)
         self.btn_calculate.setCursor(Qt.PointingHandCursor)
+        self.btn_add_plan.setCursor(Qt.PointingHandCursor)
         self.btn_settings.setCursor(Qt.PointingHandCursor)
         self.btn_switch_table.setCursor(Qt.PointingHandCursor)
 
@@ -768,7 +1092,11 @@ class CalculateWindow(QDialog):
         self.hbl_topbar.addWidget(self.lbl_unit)
         self.hbl_topbar.addSpacing(10)
         self.hbl_topbar.addWidget(self.btn_calculate)
+        self.hbl_topbar.addSpacing(10)
+        self.hbl_topbar.addWidget(self.chk_live_calculate)
         self.hbl_topbar.addStretch(1)
+        self.hbl_topbar.addWidget(self.btn_add_plan)
+        self.hbl_topbar.addSpacing(10)
         self.hbl_topbar.addWidget(self.btn_settings)
         self.hbl_topbar.addSpacing(10)
         self.hbl_topbar.addWidget(self.btn_switch_table)
@@ -782,46 +1110,170 @@ class CalculateWindow(QDialog):
 
         self.vbl_widget = QVBoxLayout(self)
         self.vbl_widget.addLayout(self.hbl_topbar)
-        self.vbl_widget.addWidget(self.wgt_settings)
         self.vbl_widget.addWidget(self.wgt_requirements)
         self.resize(self.vbl_widget.sizeHint())
 
         self.btn_calculate.clicked.connect(self.start_calculate)
+        self.btn_add_plan.clicked.connect(self.add_to_plan)
         self.btn_settings.clicked.connect(self.switch_settings_visible)
         self.btn_switch_table.clicked.connect(self.switch_table)
+        self.calculate_finished.connect(self.show_results)
+        self.ldt_production_speed.textEdited.connect(self.on_speed_edited)
+        self.timer_live_calculate.timeout.connect(self.live_calculate)
+        self.calculate_failed.connect(self.show_error)
+
+        self.set_thing(thing, value)
+        self.show()
 
+    # 新建的窗体和从回收池中取出的窗体都通过这里设置物品，并恢复到刚打开时的状态
+    def set_thing(self, thing, value):
+        self.cancel_calculate()
+        self._thing = thing
+        self._unit_results = None
+        self.setWindowTitle(thing.name)
+        self.setWindowIcon(IconCache.inst().icon(thing.icon, QSize(32, 32)))
+        self.btn_product.set_thing(thing)
+        self.ldt_production_speed.setText(str(value))
+        self.clear_requirements()
         self.tbw_current_requirement_table.setVisible(True)
         self.tbw_different_requirement_table.setVisible(False)
         self.wgt_requirements.setVisible(False)
-        self.wgt_settings.setVisible(True)
-        self.setFixedHeight(self.vbl_widget.sizeHint().height())
-        self.show()
+        self.show_settings()
 
     @classmethod
     def new_window(cls, thing, value=60, parent=None):
         if not isinstance(value, (int, float)) or value < 0:
             value = 60
 
-        new_win = cls(thing, value, parent)
+        if cls._pool and parent is None:
+            new_win = cls._pool.pop()
+            new_win.w_id = cls.win_id
+            new_win.set_thing(thing, value)
+            new_win.show()
+        else:
+            new_win = cls(thing, value, parent)
         cls.all_windows[cls.win_id] = new_win
         cls.win_id += 1
         return new_win
 
-    def start_calculate(self):
-        self.btn_calculate.setEnabled(False)
-        self.wgt_settings.activate_settings()
+    # 释放窗体及其所有子组件，共用的设置组件会先移出
+    def teardown(self):
+        self.cancel_calculate()
+        if SettingsWidget._inst is not None:
+            SettingsWidget._inst.detach(self)
+        self.clear_requirements()
+        self.setParent(None)
+        self.deleteLater()
 
-        speed = float(self.ldt_production_speed.text() or 0)
-        results, results2 = ThingsMgr.inst().calcu_requirements(self._thing, speed)
+    def clear_requirements(self):
+        self.tbw_current_requirement_table.show_requirements([])
+        self.tbw_different_requirement_table.show_requirements([])
 
-        self.tbw_current_requirement_table.show_requirements(results)
-        self.tbw_different_requirement_table.show_requirements(results2)
+    # 释放回收池中的所有窗体
+    @classmethod
+    def clear_pool(cls):
+        while cls._pool:
+            cls._pool.pop().teardown()
+
+    # 打开中的窗体、回收池中的窗体以及各自占用的内存
+    # 窗体的内存按组件数量和显示中的窗体图像大小估算，process为整个进程占用的物理内存
+    @classmethod
+    def memory_report(cls):
+        def window_info(window):
+            widgets = window.findChildren(QWidget)
+            ratio = window.devicePixelRatioF()
+            return {
+                'id': window.w_id,
+                'thing': window._thing.name,
+                'widgets': len(widgets),
+                'rows': window.tbw_current_requirement_table.model().rowCount() +
+                        window.tbw_different_requirement_table.model().rowCount(),
+                'image': int(window.width() * window.height() * ratio * ratio * 4) if window.isVisible() else 0,
+            }
+
+        live = [window_info(window) for window in cls.all_windows.values()]
+        pooled = [window_info(window) for window in cls._pool]
+        return {
+            'live': live,
+            'pooled': pooled,
+            'instances': len(cls._instances),
+            'widgets': sum(info['widgets'] for info in live + pooled),
+            'image': sum(info['image'] for info in live + pooled),
+            'process': process_memory(),
+        }
+
+    # 在后台线程中计算，正在进行的计算会被取消，只显示最后一次计算的结果
+    def start_calculate(self):
+        SettingsWidget.activate()
+        self.cancel_calculate()
+
+        speed = self.current_speed()
+        self._task = CalculateTask(self, self._thing, speed, ThingsMgr.inst().graph().current_settings())
+        self.setCursor(Qt.BusyCursor)
+        self._task.start()
+
+    def add_to_plan(self):
+        window = PlanWindow.inst()
+        window.add_target(self._thing, self.current_speed())
+        window.show()
+        window.raise_()
+        window.activateWindow()
+
+    # 输入框中的产量，无法转换为数字时返回default
+    def current_speed(self, default=0.0):
+        try:
+            return float(self.ldt_production_speed.text() or 0)
+        except ValueError:
+            return default
+
+    def on_speed_edited(self, text):
+        if self.chk_live_calculate.isChecked():
+            self.timer_live_calculate.start()
+
+    # 实时计算：设置没有改变时按新的产量缩放上一次的结果，不需要重新求解
+    def live_calculate(self):
+        SettingsWidget.activate()
+        graph = ThingsMgr.inst().graph()
+        fingerprint = graph.fingerprint(graph.current_settings())
+        if self._task is not None and graph.fingerprint(self._task.settings) == fingerprint:
+            return      # 计算完成时会按最新的产量显示
+        if self._unit_results is not None and self._unit_results[0] == fingerprint:
+            self.show_scaled_results(self.current_speed())
+        else:
+            self.start_calculate()
+
+    def cancel_calculate(self):
+        self.timer_live_calculate.stop()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self.unsetCursor()
+
+    @traced()
+    def show_results(self, task, results, results2):
+        if task is not self._task:
+            return
+        self._task = None
+        self.unsetCursor()
+        graph = ThingsMgr.inst().graph()
+        self._unit_results = (graph.fingerprint(task.settings), results, results2)
+        self.show_scaled_results(self.current_speed(task.speed))
+
+    # 按产量缩放每分钟1个产物的结果，表格结构不变时只更新单元格
+    def show_scaled_results(self, speed):
+        fingerprint, results, results2 = self._unit_results
+        self.tbw_current_requirement_table.show_requirements([req.scaled(speed) for req in results])
+        self.tbw_different_requirement_table.show_requirements([req.scaled(speed) for req in results2])
 
         self.wgt_requirements.setVisible(True)
-        self.wgt_settings.setVisible(False)
-        self.btn_settings.setText('显示设置')
-        self.setFixedHeight(self.vbl_widget.sizeHint().height())
-        self.btn_calculate.setEnabled(True)
+        self.hide_settings()
+
+    def show_error(self, task, message):
+        if task is not self._task:
+            return
+        self._task = None
+        self.unsetCursor()
+        QMessageBox.warning(self, '计算失败', message)
 
     def switch_table(self):
         if self.tbw_current_requirement_table.isVisible():
@@ -831,22 +1283,280 @@ class CalculateWindow(QDialog):
             self.tbw_current_requirement_table.setVisible(True)
             self.tbw_different_requirement_table.setVisible(False)
 
-    def switch_settings_visible(self, event=None):
-        if self.wgt_settings.isVisible():
-            self.wgt_settings.setVisible(False)
-            self.btn_settings.setText('显示设置')
-        else:
-            self.wgt_settings.setVisible(True)
-            self.btn_settings.setText('隐藏设置')
+    def settings_visible(self):
+        settings = SettingsWidget._inst
+        return settings is not None and settings.owner is self and not settings.isHidden()
 
+    def show_settings(self):
+        SettingsWidget.inst().attach(self)
+        self.btn_settings.setText('隐藏设置')
+        self.setFixedHeight(self.vbl_widget.sizeHint().height())
+
+    def hide_settings(self):
+        if self.settings_visible():
+            SettingsWidget.inst().setVisible(False)
+        self.settings_detached()
+
+    # 设置组件被隐藏或移到了其他窗体
+    def settings_detached(self):
+        self.btn_settings.setText('显示设置')
         self.setFixedHeight(self.vbl_widget.sizeHint().height())
 
+    def switch_settings_visible(self, event=None):
+        if self.settings_visible():
+            self.hide_settings()
+        else:
+            self.show_settings()
+
     def closeEvent(self, event):
         event.ignore()
+        self.cancel_calculate()
         self.hide()
-        self.setParent(None)
-        self.destroy()
-        self.all_windows[self.w_id] = None
+        self.all_windows.pop(self.w_id, None)
+        if len(self._pool) < self.pool_size and self.parent() is None:
+            if SettingsWidget._inst is not None:
+                SettingsWidget._inst.detach(self)
+            self.clear_requirements()
+            self.destroy()      # 释放系统窗口，再次显示时重新创建
+            self._pool.append(self)
+        else:
+            self.teardown()
+
+
+# 工厂规划的计算任务，所有产物一起求解
+class PlanTask(CalculateTask):
+    def __init__(self, window, products, settings):
+        super(PlanTask, self).__init__(window, None, 0, settings)
+        self.products = products
+
+    def calculate(self):
+        return ThingsMgr.inst().calcu_plan(self.products, settings=self.settings)
+
+
+# 工厂规划中的一个产物：图标、每分钟产量和删除按钮
+class PlanTargetWidget(QWidget):
+    removed = pyqtSignal(object)
+
+    def __init__(self, thing, rate, parent=None):
+        super(PlanTargetWidget, self).__init__(parent)
+        self._thing = thing
+        self.btn_thing = MTipsButton(self)
+        self.btn_thing.setFixedSize(QSize(40, 40))
+        self.btn_thing.setIconSize(QSize(40, 40))
+        self.btn_thing.set_thing(thing)
+        self.ldt_rate = QLineEdit(self)
+        self.ldt_rate.setFixedWidth(60)
+        self.ldt_rate.setValidator(QRegExpValidator(QRegExp(r"[0-9]+.[0-9]+")))
+        self.set_rate(rate)
+        self.lbl_unit = QLabel('/min', self)
+        self.btn_remove = QPushButton('删除', self)
+        self.btn_remove.setObjectName('TextButton')
+        self.btn_remove.setCursor(Qt.PointingHandCursor)
+
+        self.hbl_widget = QHBoxLayout(self)
+        self.hbl_widget.setContentsMargins(0, 0, 0, 0)
+        self.hbl_widget.addWidget(self.btn_thing)
+        self.hbl_widget.addWidget(self.ldt_rate)
+        self.hbl_widget.addWidget(self.lbl_unit)
+        self.hbl_widget.addWidget(self.btn_remove)
+        self.hbl_widget.addSpacing(10)
+        self.btn_remove.clicked.connect(lambda: self.removed.emit(self))
+
+    def thing(self):
+        return self._thing
+
+    def rate(self):
+        try:
+            return float(self.ldt_rate.text() or 0)
+        except ValueError:
+            return 0.0
+
+    def set_rate(self, rate):
+        self.ldt_rate.setText('%g' % rate)
+
+
+# 工厂规划窗体：同时生产多个产物，共用的中间产物只计算一次，表格的最后一行为整个工厂的原料、设备和功率
+# 设置与计算窗体共用，在计算窗体中修改
+class PlanWindow(QDialog):
+    calculate_finished = pyqtSignal(object, object, object)     # 任务, 各层需求, 各产物需求
+    calculate_failed = pyqtSignal(object, str)
+    targets_per_row = 4
+    _inst = None
+    style_sheet = CalculateWindow.style_sheet
+
+    def __init__(self, parent=None):
+        super(PlanWindow, self).__init__(parent)
+        self._targets = []
+        self._task = None
+
+        self.setWindowFlag(Qt.WindowContextHelpButtonHint, False)  # 无帮助按钮
+        self.setWindowFlag(Qt.MSWindowsFixedSizeDialogHint, True)  # 窗体大小固定
+        self.setStyleSheet(self.style_sheet)
+        self.setWindowTitle('工厂规划')
+        self.setWindowIcon(QIcon('Logo.png'))
+
+        self.cmb_thing = QComboBox(self)
+        self.cmb_thing.setFixedWidth(160)
+        self.cmb_thing.setEditable(True)
+        self.cmb_thing.setInsertPolicy(QComboBox.NoInsert)
+        self.cmb_thing.setView(QListView())
+        self.cmb_thing.addItems([name for name, thing in ThingsMgr.inst().all_things().items()
+                                 if thing.product_formulas() and not thing.exclude])
+        self.ldt_rate = QLineEdit('60', self)
+        self.ldt_rate.setFixedWidth(60)
+        self.ldt_rate.setValidator(QRegExpValidator(QRegExp(r"[0-9]+.[0-9]+")))
+        self.lbl_unit = QLabel('/min', self)
+        self.btn_add = QPushButton('添加', self)
+        self.btn_add.setObjectName('TextButton')
+        self.btn_calculate = QPushButton('计算', self)
+        self.btn_calculate.setObjectName('TextButton')
+        self.btn_clear = QPushButton('清空', self)
+        self.btn_clear.setObjectName('TextButton')
+        self.btn_switch_table = QPushButton('切换表格', self)
+        self.btn_switch_table.setObjectName('TextButton')
+        for button in (self.btn_add, self.btn_calculate, self.btn_clear, self.btn_switch_table):
+            button.setCursor(Qt.PointingHandCursor)
+        self.btn_calculate.setDefault(True)
+
+        self.wgt_targets = QWidget(self)
+        self.gdl_targets = QGridLayout(self.wgt_targets)
+        self.gdl_targets.setContentsMargins(0, 0, 0, 0)
+        self.wgt_requirements = QWidget(self)
+        self.tbw_current_requirement_table = RequirementTableFour(self)
+        self.tbw_different_requirement_table = RequirementTableFive(self)
+
+        self.hbl_topbar = QHBoxLayout()
+        self.hbl_topbar.addWidget(self.cmb_thing)
+        self.hbl_topbar.addWidget(self.ldt_rate)
+        self.hbl_topbar.addWidget(self.lbl_unit)
+        self.hbl_topbar.addSpacing(10)
+        self.hbl_topbar.addWidget(self.btn_add)
+        self.hbl_topbar.addSpacing(10)
+        self.hbl_topbar.addWidget(self.btn_calculate)
+        self.hbl_topbar.addStretch(1)
+        self.hbl_topbar.addWidget(self.btn_clear)
+        self.hbl_topbar.addSpacing(10)
+        self.hbl_topbar.addWidget(self.btn_switch_table)
+
+        self.vbl_requirements = QVBoxLayout(self.wgt_requirements)
+        self.vbl_requirements.setContentsMargins(0, 0, 0, 0)
+        self.vbl_requirements.addWidget(MHLine2(self))
+        self.vbl_requirements.addWidget(self.tbw_current_requirement_table)
+        self.vbl_requirements.addWidget(self.tbw_different_requirement_table)
+
+        self.vbl_widget = QVBoxLayout(self)
+        self.vbl_widget.addLayout(self.hbl_topbar)
+        self.vbl_widget.addWidget(self.wgt_targets)
+        self.vbl_widget.addWidget(self.wgt_requirements)
+
+        self.btn_add.clicked.connect(self.add_selected_target)
+        self.btn_calculate.clicked.connect(self.start_calculate)
+        self.btn_clear.clicked.connect(self.clear_targets)
+        self.btn_switch_table.clicked.connect(self.switch_table)
+        self.calculate_finished.connect(self.show_results)
+        self.calculate_failed.connect(self.show_error)
+
+        self.tbw_different_requirement_table.setVisible(False)
+        self.wgt_requirements.setVisible(False)
+        self.wgt_targets.setVisible(False)
+        self.update_height()
+
+    # 已经添加过的产物累加产量
+    def add_target(self, thing, rate):
+        for widget in self._targets:
+            if widget.thing() is thing:
+                widget.set_rate(widget.rate() + rate)
+                return
+        widget = PlanTargetWidget(thing, rate, self.wgt_targets)
+        widget.removed.connect(self.remove_target)
+        self._targets.append(widget)
+        self.layout_targets()
+
+    def add_selected_target(self):
+        thing = ThingsMgr.inst().all_things().get(self.cmb_thing.currentText())
+        if thing is None or not thing.product_formulas():
+            return
+        try:
+            rate = float(self.ldt_rate.text() or 0)
+        except ValueError:
+            return
+        self.add_target(thing, rate)
+
+    def remove_target(self, widget):
+        self._targets.remove(widget)
+        self.gdl_targets.removeWidget(widget)
+        widget.deleteLater()
+        self.layout_targets()
+
+    def clear_targets(self):
+        for widget in list(self._targets):
+            self.remove_target(widget)
+
+    def layout_targets(self):
+        for index, widget in enumerate(self._targets):
+            self.gdl_targets.addWidget(widget, index // self.targets_per_row, index % self.targets_per_row)
+        self.gdl_targets.setColumnStretch(self.targets_per_row, 1)
+        self.wgt_targets.setVisible(len(self._targets) > 0)
+        self.update_height()
+
+    # {物品名称: 每分钟产量}
+    def targets(self):
+        products = {}
+        for widget in self._targets:
+            products[widget.thing().name] = products.get(widget.thing().name, 0) + widget.rate()
+        return products
+
+    def start_calculate(self):
+        SettingsWidget.activate()
+        self.cancel_calculate()
+        self._task = PlanTask(self, self.targets(), ThingsMgr.inst().graph().current_settings())
+        self.setCursor(Qt.BusyCursor)
+        self._task.start()
+
+    def cancel_calculate(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self.unsetCursor()
+
+    @traced()
+    def show_results(self, task, results, results2):
+        if task is not self._task:
+            return
+        self._task = None
+        self.unsetCursor()
+        self.tbw_current_requirement_table.show_requirements(results)
+        self.tbw_different_requirement_table.show_requirements(results2)
+        self.wgt_requirements.setVisible(True)
+        self.update_height()
+
+    def show_error(self, task, message):
+        if task is not self._task:
+            return
+        self._task = None
+        self.unsetCursor()
+        QMessageBox.warning(self, '计算失败', message)
+
+    def switch_table(self):
+        if self.tbw_current_requirement_table.isVisible():
+            self.tbw_current_requirement_table.setVisible(False)
+            self.tbw_different_requirement_table.setVisible(True)
+        else:
+            self.tbw_current_requirement_table.setVisible(True)
+            self.tbw_different_requirement_table.setVisible(False)
+
+    def update_height(self):
+        self.setFixedHeight(self.vbl_widget.sizeHint().height())
+
+    def closeEvent(self, event):
+        self.cancel_calculate()
+        super(PlanWindow, self).closeEvent(event)
+
+    @classmethod
+    def inst(cls):
+        if cls._inst is None:
+            cls._inst = cls()
+        return cls._inst
 
 
 # 公式两边的物品
@@ -1067,9 +1777,69 @@ class AttributeWidget(QWidget):
         self.setVisible(False)
 
 
+# 鼠标悬浮提示框中名称以下的部分：属性、合成公式或相关公式，只用于绘制缓存的图片
+class ThingTooltipContent(QWidget):
+    text_style = '''
+        QLabel {
+            color: #99FFFF; 
+            font-size: 9pt; 
+            qproperty-alignment: "AlignLeft | AlignBottom";
+        }
+    '''
+
+    def __init__(self, thing, relevant=False, parent=None):
+        super(ThingTooltipContent, self).__init__(parent)
+        self.wgt_attribute = AttributeWidget(self)
+        self.line = MHLine1(self)
+        self.lbl_text = QLabel(self)
+        self.lbl_text.setStyleSheet(self.text_style)
+
+        self.vbl_formulas = QVBoxLayout()
+        self.vbl_formulas.setSpacing(0)
+        self.hbl_formulas = QHBoxLayout()
+        self.hbl_formulas.setSpacing(0)
+        self.hbl_formulas.addStretch(1)
+        self.hbl_formulas.addLayout(self.vbl_formulas)
+        self.hbl_formulas.addStretch(1)
+        self.vbl_widget = QVBoxLayout(self)
+        self.vbl_widget.setContentsMargins(0, 0, 0, 0)
+        self.vbl_widget.addWidget(self.wgt_attribute)
+        self.vbl_widget.addWidget(self.line)
+        self.vbl_widget.addWidget(self.lbl_text)
+        self.vbl_widget.addLayout(self.hbl_formulas)
+
+        self.wgt_attribute.on_show(thing)
+        if relevant:
+            formulas = thing.material_formulas()
+            self.lbl_text.setText('相关公式：')
+        else:
+            formulas = thing.product_formulas()
+            self.lbl_text.setText('合成公式：')
+        self.line.setVisible(len(formulas) > 0)
+        self.lbl_text.setVisible(len(formulas) > 0)
+        for formula in formulas:
+            self.vbl_formulas.addWidget(FormulaWidget(formula, False))
+        self._empty = self.wgt_attribute.isHidden() and not formulas
+
+    # 绘制成透明背景的图片，没有任何内容时返回None
+    def render_pixmap(self, device_pixel_ratio=1.0):
+        if self._empty:
+            return None
+        self.ensurePolished()
+        self.vbl_widget.activate()
+        self.resize(self.vbl_widget.sizeHint())
+        pixmap = QPixmap(self.size() * device_pixel_ratio)
+        pixmap.setDevicePixelRatio(device_pixel_ratio)
+        pixmap.fill(Qt.transparent)
+        self.render(pixmap, QPoint(), QRegion(), QWidget.DrawChildren)
+        return pixmap
+
+
 # 鼠标悬浮提示框
+# 名称以下的内容只与物品和是否显示相关公式有关，第一次显示时绘制成图片后缓存，之后只需设置图片并移动窗口
 class ThingTooltipWindow(QFrame):
     _inst = None
+    cache_size = 128
     name_style = '''
         QLabel {
             color: #FFE594; 
@@ -1092,33 +1862,21 @@ class ThingTooltipWindow(QFrame):
         self.timer_show = QTimer(self)
         self._thing = None
         self._count = None
+        self._contents = OrderedDict()  # {(物品, 是否相关公式): 内容图片或None}
         self.pos = None
         self.lbl_name = QLabel(self)
         self.lbl_name.setStyleSheet(self.name_style)
         self.lbl_count = QLabel(self)
         self.lbl_count.setStyleSheet(self.count_style)
-        self.wgt_attribute = AttributeWidget(self)
-        self.line = MHLine1(self)
-        self.lbl_text = QLabel(self)
-        self.lbl_text.setStyleSheet(self.count_style)
+        self.lbl_content = QLabel(self)
 
         self.hbl_name = QHBoxLayout()
         self.hbl_name.addWidget(self.lbl_name)
         self.hbl_name.addWidget(self.lbl_count, 1)
-        self.vbl_formulas = QVBoxLayout()
-        self.vbl_formulas.setSpacing(0)
-        self.hbl_formulas = QHBoxLayout()
-        self.hbl_formulas.setSpacing(0)
-        self.hbl_formulas.addStretch(1)
-        self.hbl_formulas.addLayout(self.vbl_formulas)
-        self.hbl_formulas.addStretch(1)
         self.vbl_window = QVBoxLayout(self)
         self.vbl_window.setContentsMargins(0, 0, 0, 0)
         self.vbl_window.addLayout(self.hbl_name)
-        self.vbl_window.addWidget(self.wgt_attribute)
-        self.vbl_window.addWidget(self.line)
-        self.vbl_window.addWidget(self.lbl_text)
-        self.vbl_window.addLayout(self.hbl_formulas)
+        self.vbl_window.addWidget(self.lbl_content)
         self.timer_show.timeout.connect(self.on_show)
 
     def delay_show(self, thing, pos, count=None):
@@ -1133,6 +1891,24 @@ class ThingTooltipWindow(QFrame):
         self._count = None
         self.on_show(True)
 
+    def content(self, thing, relevant=False):
+        key = (thing, relevant)
+        if key in self._contents:
+            self._contents.move_to_end(key)
+            return self._contents[key]
+
+        with span('ThingTooltipWindow.content', thing=thing.name, relevant=relevant):
+            widget = ThingTooltipContent(thing, relevant)
+            pixmap = widget.render_pixmap(self.devicePixelRatioF())
+            widget.deleteLater()
+        self._contents[key] = pixmap
+        if len(self._contents) > self.cache_size:
+            self._contents.popitem(last=False)
+        return pixmap
+
+    def clear_cache(self):
+        self._contents.clear()
+
     def on_show(self, relevant=False):
         self.timer_show.stop()
         if not isinstance(self._thing, Thing):
@@ -1144,20 +1920,10 @@ class ThingTooltipWindow(QFrame):
             self.lbl_count.setText(' x '+str(self._count))
             self.lbl_count.setVisible(True)
 
-        self.wgt_attribute.on_show(self._thing)
-        if relevant:
-            formulas = self._thing.material_formulas()
-            text = '相关公式：'
-        else:
-            formulas = self._thing.product_formulas()
-            text = '合成公式：'
-        if len(formulas) > 0:
-            self.lbl_text.setText(text)
-            self.lbl_text.setVisible(True)
-            self.line.setVisible(True)
-        for formula in formulas:
-            item = FormulaWidget(formula, False)
-            self.vbl_formulas.addWidget(item)
+        pixmap = self.content(self._thing, relevant)
+        if pixmap is not None:
+            self.lbl_content.setPixmap(pixmap)
+            self.lbl_content.setVisible(True)
         self.move(self.pos)
         self.show()
         self.resize(self.vbl_window.sizeHint())
@@ -1165,14 +1931,7 @@ class ThingTooltipWindow(QFrame):
     def on_hide(self):
         self.timer_show.stop()
         self.lbl_count.setVisible(False)
-        self.wgt_attribute.on_hide()
-        self.line.setVisible(False)
-        self.lbl_text.setVisible(False)
-        for row in range(self.vbl_formulas.count()):
-            widget = self.vbl_formulas.itemAt(0).widget()
-            if widget:
-                self.vbl_formulas.removeWidget(widget)
-                widget.deleteLater()
+        self.lbl_content.setVisible(False)
         self.hide()
 
     @classmethod
@@ -1182,6 +1941,19 @@ class ThingTooltipWindow(QFrame):
         return cls._inst
 
 
+# 设置了DSP_STALL时启动界面阻塞检测，界面线程中的定时器按固定间隔报告事件循环仍在运行
+def install_stall_watchdog(app):
+    watchdog = StallWatchdog.from_env()
+    if watchdog is None:
+        return None
+    timer = QTimer(app)
+    timer.timeout.connect(watchdog.beat)
+    timer.start(watchdog.beat_interval)
+    watchdog.start()
+    app.aboutToQuit.connect(watchdog.stop)
+    return watchdog
+
+
 def trans_power(value):
     if value >= 1000000000:
         return '%.2f TW' % (value / 1000000000)
@@ -1193,354 +1965,12 @@ def trans_power(value):
         return '%d kW' % value
 
 
-class Thing(object):
-    def __init__(self, name, icon='', row=-1, col=-1, exclude=None):
-        self.name = name
-        self.icon = icon
-        self.row = row
-        self.col = col
-        self.exclude = exclude
-
-        self._selected_formula = None
-        self._product_formulas = []
-        self._material_formulas = []
-
-    def selected_formula(self):
-        if self._selected_formula:
-            return self._selected_formula
-        elif len(self._product_formulas) > 0:
-            return self._product_formulas[0]
-        else:
-            return None
-
-    def set_selected_formula(self, formula):
-        if formula is not None and formula in self._product_formulas:
-            self._selected_formula = formula
-
-    def product_formulas(self):
-        return self._product_formulas
-
-    def append_product_formula(self, formula):
-        if formula not in self._product_formulas:
-            self._product_formulas.append(formula)
-
-    def material_formulas(self):
-        return self._material_formulas
-
-    def append_material_formula(self, formula):
-        if formula not in self._material_formulas:
-            self._material_formulas.append(formula)
-
-    def calcu_requirement(self, speed, check=False):
-        formula = self.selected_formula()
-        if formula:
-            return formula.calcu_requirement(self, speed, check)
-
-        return None
-
-
-class Building(Thing):
-    def __init__(self, name, icon='', row=-1, col=-1, exclude=None, facility_type=None, work_consumption=None,
-                 idle_consumption=None, power=None, input_power=None, output_power=None, basic_generation=None,
-                 max_charging_power=None, transport_speed=None, collecting_speed=None, collecting_speed_2=None,
-                 cycle_speed=None, production_speed=None, origin=None, mineral=None):
-        super(Building, self).__init__(name, icon, row, col, exclude)
-        self.facility_type = facility_type
-        self.work_consumption = work_consumption
-        self.idle_consumption = idle_consumption
-        self.power = power
-        self.input_power = input_power
-        self.output_power = output_power
-        self.basic_generation = basic_generation
-        self.max_charging_power = max_charging_power
-        self.transport_speed = transport_speed
-        self.collecting_speed = collecting_speed
-        self.collecting_speed_2 = collecting_speed_2
-        self.cycle_speed = cycle_speed
-        self.production_speed = production_speed
-        self.origin = origin
-        self.mineral = mineral
-
-
-class Formula(object):
-    mineral_level = 0
-    facility_selected = {'smelting': '电弧熔炉', 'assembler': '制造台MK.I', 'chemical': '化工厂', 'research': '矩阵研究站'}
-
-    def __init__(self, products, materials, time=-1, facility=None, recipe=None, relation=None, time_str=None):
-        self.products = []      # [(thing1, count1), (thing2, count2), ...]
-        self.materials = []
-        self.time = time
-        self.facility = None
-        self.recipe = None
-        self.relation = None
-        self.time_str = time_str
-
-        for name, count in products.items():
-            thing = ThingsMgr.inst().get_thing(name)
-            thing.append_product_formula(self)
-            self.products.append((thing, count))
-
-        for name, count in materials.items():
-            thing = ThingsMgr.inst().get_thing(name)
-            thing.append_material_formula(self)
-            self.materials.append((thing, count))
-
-        if facility:
-            self.facility = ThingsMgr.inst().get_thing(facility)
-
-        if recipe:
-            self.recipe = ThingsMgr.inst().get_thing(recipe)
-            self.recipe.append_product_formula(self)
-
-        if relation:
-            self.relation = ThingsMgr.inst().get_thing(relation)
-
-    # 计算每分钟的产物、原料和设备数量，speed为每分钟产物thing的生产数量
-    def calcu_requirement(self, product, speed, check=False):
-        if self.recipe == product:
-            product = self.relation
-
-        if check and (product.exclude or self.facility.origin):
-            return None
-
-        requirement = Requirement(product.name, speed)
-        product_count = None
-        for item, count in self.products:
-            if item.name == product.name:
-                product_count = count
-                break
-
-        facility_count = 0
-        if isinstance(self.time, (int, float)) and self.time > 0:
-            facility_count = (speed * self.time) / (product_count * 60.0)
-
-        if self.facility.mineral:
-            facility_count = facility_count / (1 + 0.1 * self.mineral_level)
-
-        use_facility = self.facility
-        if self.facility.facility_type in self.facility_selected:
-            use_facility = ThingsMgr.inst().get_thing(self.facility_selected[self.facility.facility_type])
-            facility_count = facility_count / use_facility.production_speed
-
-        requirement.add_facility([use_facility.name, facility_count])
-
-        materials_count = {}
-        for item, count in self.materials:
-            materials_count[item.name] = count * speed / product_count
-
-        requirement.add_materials(materials_count)
-
-        byproducts_count = {}
-        for item, count in self.products:
-            if item != product:
-                byproducts_count[item.name] = count * speed / product_count
-
-        return requirement
-
-
-class Requirement(object):
-    def __init__(self, product=None, count=0):
-        self.product = product
-        self.count = count
-        self._materials = {}        # {name1: count1, name2: count2, ...}
-        self._facilities = []       # [[name1, count1], [name2, count2], ...]
-        self._byproducts = {}
-
-    def product_list(self):
-        if self.product:
-            return [(self.product, self.count)]
-        return []
-
-    def materials(self):
-        return self._materials
-
-    def materials_list(self):
-        return list(self._materials.items())
-
-    def add_materials(self, data):
-        for name, count in data.items():
-            self._materials[name] = self._materials.get(name, 0) + count
-
-    def byproducts(self):
-        return self._byproducts
-
-    def byproducts_list(self):
-        return list(self._byproducts.items())
-
-    def add_byproducts(self, data):
-        for name, count in data.items():
-            self._byproducts[name] = self._byproducts.get(name, 0) + count
-
-    def facilities(self):
-        return self._facilities
-
-    def add_facilities(self, data):
-        self._facilities.extend(data)
-
-    def add_facility(self, data):
-        self._facilities.append(data)
-
-    def merge_facilities(self, data):
-        if len(data) == 1 and len(self._facilities) == len(data):
-            self._facilities[0][1] += data[0][1]
-        else:
-            self.add_facilities(data)
-
-    def merge_requirement(self, requirement, merge=False):
-        self.add_materials(requirement.materials())
-        self.add_byproducts(requirement.byproducts())
-        if merge and self.product and self.product == requirement.product:
-            self.count += requirement.count
-            self.merge_facilities(requirement.facilities())
-        else:
-            self.add_facilities(requirement.facilities())
-
-    def work_consumption(self, max_=False):
-        total = 0
-        for name, count in self._facilities:
-            thing = ThingsMgr.inst().get_thing(name)
-            if thing.work_consumption:
-                total += thing.work_consumption * (math.ceil(count) if max_ else count)
-        return total
-
-
-class ThingsMgr(object):
-    _inst = None
-
-    def __init__(self):
-        self._all_things = {}
-        self._components = {}
-        self._others = {}
-        self._buildings = {}
-        self._items = {}
-        self._all_formulas = []
-
-    def load_things(self):
-        with open(os.path.join(FILES_FOLDER, 'Components.json'), 'r', encoding='utf-8') as file:
-            for name, data in json.load(file).items():
-                self._components[name] = Thing(name, **data)
-
-        with open(os.path.join(FILES_FOLDER, 'OtherComponents.json'), 'r', encoding='utf-8') as file:
-            for name, data in json.load(file).items():
-                self._others[name] = Thing(name, **data)
-
-        with open(os.path.join(FILES_FOLDER, 'Buildings.json'), 'r', encoding='utf-8') as file:
-            for name, data in json.load(file).items():
-                self._buildings[name] = Building(name, **data)
-
-        self._items.update(self._components)
-        self._items.update(self._others)
-        self._all_things.update(self._components)
-        self._all_things.update(self._buildings)
-        self._all_things.update(self._others)
-
-    def load_formulas(self):
-        with open(os.path.join(FILES_FOLDER, 'Formulas.json'), 'r', encoding='utf-8') as file:
-            for data in json.load(file):
-                self._all_formulas.append(Formula(**data))
-
-    def components(self):
-        return self._components
-
-    def buildings(self):
-        return self._buildings
-
-    def others(self):
-        return self._others
-
-    def get_thing(self, name):
-        thing = self._all_things.get(name)
-        if thing is None:
-            print('get_thing', name)
-        return thing
-
-    def get_multi_formula_things(self):
-        temp = []
-        for thing in self._all_things.values():
-            if len(thing.product_formulas()) > 1:
-                temp.append(thing)
-        return temp
-
-    def get_by_facility_type(self, facility_type):
-        temp = []
-        for thing in self._buildings.values():
-            if facility_type == thing.facility_type:
-                temp.append(thing)
-        return temp
-
-    def calcu_requirements(self, product, speed):
-        if product.selected_formula() is None:
-            return None
-
-        result = self.calcu_all_requirements({product.name: speed})
-        current_requirement_list = []
-        different_requirements = {}
-        if len(result) == 1:
-            return [product.calcu_requirement(speed)], []
-
-        final_requirement = Requirement()
-        for current_result in result:
-            requirement = Requirement()
-            for data in current_result:
-                req = data[2]
-                if req:
-                    requirement.merge_requirement(req)
-                    if req.product in different_requirements:
-                        different_requirements[req.product].merge_requirement(req, True)
-                    else:
-                        different_requirements[req.product] = req
-                    final_requirement.add_byproducts(req.byproducts())
-                else:
-                    final_requirement.add_materials({data[0]: data[1]})
-
-            current_requirement_list.append(requirement)
-
-        different_final_requirement = Requirement(product.name, speed)
-        different_requirements = list(different_requirements.values())
-        for req in different_requirements:
-            different_final_requirement.merge_requirement(req)
-            final_requirement.add_facilities(req.facilities())
-
-        current_requirement_list.append(final_requirement)
-        different_requirements.append(Requirement())
-        different_requirements.append(different_final_requirement)
-        return current_requirement_list, different_requirements
-
-    def calcu_all_requirements(self, products, all_requirements=None):
-        if all_requirements is None:
-            all_requirements = []
-
-        requirements = []
-        materials = {}
-        for name, count in products.items():
-            thing = self.get_thing(name)
-            req = thing.calcu_requirement(count, True)
-            if req:
-                for name2, count2 in req.materials_list():
-                    materials[name2] = materials.get(name2, 0) + count2
-
-            requirements.append((name, count, req))
-
-        all_requirements.append(requirements)
-        if materials:
-            return self.calcu_all_requirements(materials, all_requirements)
-        else:
-            return all_requirements
-
-    @classmethod
-    def inst(cls):
-        if cls._inst is None:
-            cls._inst = cls()
-        return cls._inst
-
-
 if __name__ == '__main__':
-    # 必须先加载物品再加载公式
-    ThingsMgr.inst().load_things()
-    ThingsMgr.inst().load_formulas()
+    ThingsMgr.load()
 
     app = QApplication(sys.argv)
     app.setStyleSheet(STYLE_SHEET)
+    install_stall_watchdog(app)
     ThingTooltipWindow.inst()
     win = MainWindow()
     win.show()  # 显示主窗体
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 性能测试：数据加载、需求计算和界面组件的创建，界面部分在Qt的offscreen平台上运行，不需要显示器
+# 用法：
+#   python DSPBench.py --output baseline.json
+#   python DSPBench.py --compare baseline.json --threshold 0.2
+# 结果以JSON输出，每项记录各次运行的耗时（毫秒）；--compare与保存的结果比较，
+# 中位数比基准慢threshold以上的项目记为退化，有退化时返回1
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from DSPCore import FILES_FOLDER, Formula, ThingsMgr, load_numpy
+
+
+BENCH_VERSION = 1
+RATES = (1, 60, 3600)
+
+
+class Bench(object):
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    # 运行func repeat次并记录耗时，setup的耗时不计入，func的返回值记录为该项的附加信息
+    def run(self, name, func, setup=None, repeat=None):
+        times = []
+        info = None
+        for _ in range(repeat or self.repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            info = func()
+            times.append((time.perf_counter() - start) * 1000)
+        result = {
+            'runs': len(times),
+            'first': times[0],
+            'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.mean(times),
+        }
+        if isinstance(info, dict):
+            result.update(info)
+        self.results[name] = result
+        print('%-40s %10.3f ms' % (name, result['median']), file=sys.stderr)
+        return result
+
+
+def new_mgr():
+    ThingsMgr._inst = None
+    return ThingsMgr.inst()
+
+
+def bench_load(bench, folder):
+    mgr = None
+
+    def load_things():
+        nonlocal mgr
+        mgr = new_mgr()
+        mgr.load_things(folder)
+
+    def load_formulas():
+        mgr.load_formulas(folder)
+
+    def both():
+        load_things()
+        load_formulas()
+
+    bench.run('load.things', load_things)
+    bench.run('load.formulas', load_formulas, setup=load_things)
+    bench.run('load.all', both)
+
+    # 从快照加载，快照写在临时文件夹中，不影响正常使用的快照
+    with tempfile.TemporaryDirectory() as temp:
+        snapshot = os.path.join(temp, 'ThingsMgr.snapshot')
+        mgr.write_snapshot(folder, snapshot)
+        bench.run('load.snapshot', lambda: ThingsMgr.read_snapshot(folder, snapshot))
+
+    mgr = new_mgr()
+    mgr.load_things(folder)
+    mgr.load_formulas(folder)
+    return mgr
+
+
+# 默认设置、最快的设备加最高矿物利用等级、所有物品使用第二个公式
+def settings_combinations(mgr):
+    graph = mgr.graph()
+    fastest = {}
+    for facility_type in Formula.facility_selected:
+        buildings = mgr.get_by_facility_type(facility_type)
+        fastest[facility_type] = max(buildings, key=lambda thing: thing.production_speed or 0).name
+    alternative = {thing.name: 1 for thing in mgr.get_multi_formula_things()}
+    return {
+        'default': graph.current_settings(),
+        'fastest': graph.make_settings(mineral_level=10, facilities=fastest),
+        'alternative': graph.make_settings(formulas=alternative),
+    }
+
+
+def bench_solve(bench, mgr, backends):
+    things = [thing for thing in mgr.all_things().values() if thing.product_formulas()]
+    # 可计算的物品比缓存多，按顺序逐个计算时缓存总是未命中，warm需要缓存能容纳所有物品
+    mgr.cache_size = max(mgr.cache_size, len(things))
+
+    if 'matrix' in backends:
+        try:
+            load_numpy('矩阵求解')
+        except RuntimeError as error:
+            print('跳过矩阵求解测试：%s' % error, file=sys.stderr)
+            backends = [backend for backend in backends if backend != 'matrix']
+
+    for settings_name, settings in settings_combinations(mgr).items():
+        for backend in backends:
+            def calculate():
+                errors = 0
+                for thing in things:
+                    for rate in RATES:
+                        try:
+                            mgr.calcu_requirements(thing, rate, backend, settings)
+                        except ValueError:
+                            errors += 1
+                return {'things': len(things), 'rates': len(RATES), 'errors': errors}
+
+            # cold每次清空缓存重新求解，warm使用上一次的缓存
+            prefix = 'solve.%s.%s' % (settings_name, backend)
+            bench.run(prefix + '.cold', calculate, setup=mgr.clear_cache)
+            bench.run(prefix + '.warm', calculate)
+
+
+def bench_widgets(bench, mgr):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtWidgets import QApplication
+        import DSP
+    except ImportError as error:
+        print('跳过界面测试：%s' % error, file=sys.stderr)
+        return
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    app.setStyleSheet(DSP.STYLE_SHEET)
+    DSP.ThingTooltipWindow.inst()
+
+    def dispose(widget):
+        widget.setParent(None)
+        widget.deleteLater()
+        app.processEvents()
+
+    def main_window():
+        window = DSP.MainWindow()
+        window.show()
+        app.processEvents()
+        return window
+
+    def settings_widget():
+        widget = DSP.SettingsWidget()
+        widget.show()
+        app.processEvents()
+        return widget
+
+    thing = mgr.get_thing('宇宙矩阵')
+
+    def calculate_window():
+        window = DSP.CalculateWindow(thing, 60)
+        app.processEvents()
+        return window
+
+    current, different = mgr.calcu_requirements(thing, 60)
+
+    def requirement_table():
+        table = DSP.RequirementTableFive()
+        table.show_requirements(different)
+        table.show()
+        app.processEvents()
+        return table
+
+    for name, func, release in (('widget.main_window', main_window, dispose),
+                                ('widget.settings_widget', settings_widget, dispose),
+                                ('widget.calculate_window', calculate_window, lambda window: window.teardown()),
+                                ('widget.requirement_table_five', requirement_table, dispose)):
+        widgets = []
+
+        def create():
+            widgets.append(func())
+
+        # 释放上一次创建的组件不计入耗时
+        def release_previous():
+            while widgets:
+                release(widgets.pop())
+            app.processEvents()
+
+        bench.run(name, create, setup=release_previous)
+        release_previous()
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            print('%-40s %10.3f ms  (新增)' % (name, result['median']))
+            continue
+        ratio = result['median'] / base['median'] if base['median'] > 0 else 1
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  退化'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = '  提升'
+        print('%-40s %10.3f ms %10.3f ms %+7.1f%%%s' % (name, base['median'], result['median'], (ratio - 1) * 100, flag))
+    for name in sorted(set(baseline) - set(results)):
+        print('%-40s 本次没有运行' % name)
+    return regressions
+
+
+# 内存占用只输出变化，不记为退化
+def compare_memory(memory, baseline):
+    if not baseline:
+        return
+    for name in ('things', 'formulas', 'graph', 'total'):
+        if name in baseline:
+            print('%-40s %10.1f KB %10.1f KB %+7.1f%%' % (
+                'memory.' + name, baseline[name] / 1024, memory[name] / 1024,
+                (memory[name] / baseline[name] - 1) * 100 if baseline[name] else 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='戴森球计划计算器性能测试')
+    parser.add_argument('--files-folder', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), FILES_FOLDER),
+                        help='数据文件所在的文件夹')
+    parser.add_argument('--repeat', type=int, default=5, help='每项重复运行的次数')
+    parser.add_argument('--backend', choices=ThingsMgr.backends, action='append',
+                        help='测试的求解方式，默认为所有方式')
+    parser.add_argument('--no-widgets', action='store_true', help='不测试界面组件')
+    parser.add_argument('--output', help='结果保存到文件，默认输出到标准输出')
+    parser.add_argument('--compare', help='与保存的结果比较')
+    parser.add_argument('--threshold', type=float, default=0.2, help='中位数变慢超过该比例记为退化，默认0.2')
+    args = parser.parse_args(argv)
+
+    # 界面使用相对路径读取图片
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    bench = Bench(max(1, args.repeat))
+    mgr = bench_load(bench, args.files_folder)
+    bench_solve(bench, mgr, args.backend or ThingsMgr.backends)
+    if not args.no_widgets:
+        bench_widgets(bench, mgr)
+
+    memory = mgr.memory_report()
+    print('%-40s %10.1f KB' % ('memory.model', memory['total'] / 1024), file=sys.stderr)
+    output = {
+        'version': BENCH_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': bench.repeat,
+        'results': bench.results,
+        'memory': memory,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(output, file, ensure_ascii=False, indent=2)
+    elif not args.compare:
+        json.dump(output, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline.get('version') != BENCH_VERSION:
+            parser.error('基准文件的版本不同')
+        regressions = compare(bench.results, baseline['results'], args.threshold)
+        compare_memory(memory, baseline.get('memory'))
+        if regressions:
+            print('退化：%s' % '，'.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
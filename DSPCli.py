@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 命令行计算，不导入PyQt5，结果以JSON输出
+# 用法：
+#   python DSPCli.py 宇宙矩阵 60 --mineral-level 2 --facility assembler=制造台MK.III
+#   python DSPCli.py --file plans.json --formula 精炼油=（公式）重整精炼
+#   python DSPCli.py --file plans.json --plan
+# plans.json为[{"target": "宇宙矩阵", "speed": 60}, ...]，--plan把所有计划合并为一个工厂规划一起计算
+
+import argparse
+import json
+import math
+import os
+import sys
+
+from DSPCore import FILES_FOLDER, Formula, ThingsMgr
+
+
+def parse_pair(text):
+    if '=' not in text:
+        raise argparse.ArgumentTypeError('格式应为 key=value：%s' % text)
+    key, value = text.split('=', 1)
+    return key.strip(), value.strip()
+
+
+# 每分钟产量，必须是有限的非负数，NaN和无穷大无法输出为合法的JSON
+def parse_speed(value):
+    try:
+        speed = float(value)
+    except (TypeError, ValueError):
+        raise argparse.ArgumentTypeError('产量不是数字：%s' % value)
+    if not math.isfinite(speed) or speed < 0:
+        raise argparse.ArgumentTypeError('产量应为有限的非负数：%s' % value)
+    return speed
+
+
+def parse_level(text):
+    if not text.strip().isdigit():
+        raise argparse.ArgumentTypeError('矿物利用等级应为非负整数：%s' % text)
+    return int(text)
+
+
+# 计划文件中的一项，返回(产物名称, 产量)，格式不对时抛出argparse.ArgumentTypeError
+def parse_plan(plan):
+    if not isinstance(plan, dict):
+        raise argparse.ArgumentTypeError('计划应为对象：%s' % plan)
+    target = plan.get('target')
+    if not isinstance(target, str):
+        raise argparse.ArgumentTypeError('计划中缺少产物名称：%s' % plan)
+    return target, parse_speed(plan.get('speed', 60))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='戴森球计划生产需求计算')
+    parser.add_argument('target', nargs='?', help='产物名称')
+    parser.add_argument('speed', nargs='?', type=parse_speed, default=60, help='每分钟生产数量，默认60')
+    parser.add_argument('--file', help='包含多个计划的JSON文件，"-"表示标准输入')
+    parser.add_argument('--files-folder', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), FILES_FOLDER),
+                        help='数据文件所在的文件夹')
+    parser.add_argument('--mineral-level', type=parse_level, default=Formula.mineral_level, help='矿物利用等级')
+    parser.add_argument('--facility', type=parse_pair, action='append', default=[],
+                        help='设备类型=设备名称，例如 assembler=制造台MK.III')
+    parser.add_argument('--formula', type=parse_pair, action='append', default=[],
+                        help='物品=公式序号或配方名称，例如 精炼油=1')
+    parser.add_argument('--plan', action='store_true', help='把所有计划合并为一个工厂规划，共用的中间产物只计算一次')
+    parser.add_argument('--backend', choices=ThingsMgr.backends, default='topological', help='求解方式')
+    parser.add_argument('--indent', type=int, default=None, help='JSON缩进')
+    args = parser.parse_args(argv)
+    if args.target is None and args.file is None:
+        parser.error('需要指定产物名称或--file')
+    return parser, args
+
+
+def make_settings(parser, args):
+    try:
+        return ThingsMgr.inst().graph().make_settings(args.mineral_level, dict(args.facility), dict(args.formula))
+    except (TypeError, ValueError) as error:
+        parser.error(str(error))
+
+
+def load_plans(parser, args):
+    if args.file is None:
+        return [{'target': args.target, 'speed': args.speed}]
+
+    if args.file == '-':
+        plans = json.load(sys.stdin)
+    else:
+        with open(args.file, 'r', encoding='utf-8') as file:
+            plans = json.load(file)
+    if not isinstance(plans, list):
+        parser.error('计划文件应为列表')
+    return plans
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+    mgr = ThingsMgr.load(args.files_folder)
+    settings = make_settings(parser, args)
+
+    if args.plan:
+        products = {}
+        errors = []
+        for plan in load_plans(parser, args):
+            try:
+                target, speed = parse_plan(plan)
+            except argparse.ArgumentTypeError as error:
+                errors.append(str(error))
+                continue
+            products[target] = products.get(target, 0) + speed
+        try:
+            if errors:
+                raise ValueError('；'.join(errors))
+            result = mgr.calcu_plan_summary(products, args.backend, settings)
+        except ValueError as error:
+            result = {'targets': products, 'error': str(error)}
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=args.indent)
+        sys.stdout.write('\n')
+        return 0 if 'error' not in result else 1
+
+    results = []
+    for plan in load_plans(parser, args):
+        try:
+            target, speed = parse_plan(plan)
+        except argparse.ArgumentTypeError as error:
+            target = plan.get('target') if isinstance(plan, dict) else None
+            results.append({'target': target, 'error': str(error)})
+            continue
+        thing = mgr.all_things().get(target)
+        if thing is None:
+            results.append({'target': target, 'error': '未知的物品'})
+            continue
+        try:
+            summary = mgr.calcu_summary(thing, speed, args.backend, settings)
+        except ValueError as error:
+            results.append({'target': thing.name, 'error': str(error)})
+            continue
+        results.append(summary or {'target': thing.name, 'error': '没有合成公式'})
+
+    output = results if args.file is not None else results[0]
+    json.dump(output, sys.stdout, ensure_ascii=False, indent=args.indent)
+    sys.stdout.write('\n')
+    return 0 if all('error' not in result for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1422 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 物品、公式和需求计算，不依赖PyQt5，可以在没有界面的环境中使用
+
+import hashlib
+import json
+import math
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import types
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from DSPTrace import span, traced
+
+
+FILES_FOLDER = "Files"
+CACHE_FOLDER = "Cache"
+SNAPSHOT_FILE = "ThingsMgr.snapshot"
+SNAPSHOT_VERSION = 5     # 快照中保存的对象结构改变时需要增加
+
+numpy = None    # 按需导入，只有矩阵求解和批量计算需要
+
+
+def load_numpy(usage):
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            raise RuntimeError('%s需要安装numpy' % usage)
+        numpy = module
+    return numpy
+
+
+# 当前进程占用的物理内存（字节），无法获取时返回None
+def process_memory():
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# obj及其引用的所有对象占用的内存（字节），seen中的对象不重复计算，obj引用的skip类型的对象不计算，
+# 类、函数和模块也不计算。用于估算加载的物品和公式占用的内存
+def deep_sizeof(obj, seen=None, skip=()):
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            children = list(obj.keys()) + list(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            children = list(obj)
+        elif isinstance(obj, (str, bytes, int, float, array)):
+            continue
+        else:
+            children = [getattr(obj, '__dict__', None)]
+            for cls in type(obj).__mro__:
+                slots = cls.__dict__.get('__slots__', ())
+                for slot in (slots,) if isinstance(slots, str) else slots:
+                    children.append(getattr(obj, slot, None))
+        stack.extend(child for child in children if child is not None and not isinstance(child, skip))
+    return total
+
+
+# 物品和公式数量较多，都使用__slots__，不为每个对象创建__dict__；名称都经过sys.intern，所有需求共用同一个字符串
+class Thing(object):
+    __slots__ = ('name', 'icon', 'row', 'col', 'exclude', 'id',
+                 '_selected_formula', '_product_formulas', '_material_formulas')
+
+    def __init__(self, name, icon='', row=-1, col=-1, exclude=None):
+        self.name = sys.intern(name)
+        self.icon = icon
+        self.row = row
+        self.col = col
+        self.exclude = exclude
+        self.id = -1
+
+        self._selected_formula = None
+        self._product_formulas = []
+        self._material_formulas = []
+
+    def selected_formula(self):
+        if self._selected_formula:
+            return self._selected_formula
+        elif len(self._product_formulas) > 0:
+            return self._product_formulas[0]
+        else:
+            return None
+
+    def set_selected_formula(self, formula):
+        if formula is not None and formula in self._product_formulas:
+            self._selected_formula = formula
+
+    def product_formulas(self):
+        return self._product_formulas
+
+    def append_product_formula(self, formula):
+        if formula not in self._product_formulas:
+            self._product_formulas.append(formula)
+
+    def material_formulas(self):
+        return self._material_formulas
+
+    def append_material_formula(self, formula):
+        if formula not in self._material_formulas:
+            self._material_formulas.append(formula)
+
+    def calcu_requirement(self, speed, check=False):
+        formula = self.selected_formula()
+        if formula:
+            return formula.calcu_requirement(self, speed, check)
+
+        return None
+
+
+# 建筑的属性大多为None，只有facility_type单独保存，其余属性中不为None的保存在_extra中，
+# 读取时通过__getattr__查找，没有的属性为None。这些属性加载后只读
+class Building(Thing):
+    __slots__ = ('facility_type', '_extra')
+    attributes = ('work_consumption', 'idle_consumption', 'power', 'input_power', 'output_power', 'basic_generation',
+                  'max_charging_power', 'transport_speed', 'collecting_speed', 'collecting_speed_2', 'cycle_speed',
+                  'production_speed', 'origin', 'mineral')
+
+    def __init__(self, name, icon='', row=-1, col=-1, exclude=None, facility_type=None, **attributes):
+        super(Building, self).__init__(name, icon, row, col, exclude)
+        for attr in attributes:
+            if attr not in self.attributes:
+                raise TypeError('%s：未知的建筑属性%s' % (name, attr))
+        self.facility_type = facility_type
+        self._extra = {attr: value for attr, value in attributes.items() if value is not None} or None
+
+    # 只在正常查找失败时调用。以下划线开头的名称直接失败，避免反序列化时_extra还没有设置就递归查找
+    def __getattr__(self, attr):
+        if attr.startswith('_') or attr not in self.attributes:
+            raise AttributeError(attr)
+        extra = self._extra
+        return extra.get(attr) if extra else None
+
+
+class Formula(object):
+    __slots__ = ('products', 'materials', 'time', 'facility', 'recipe', 'relation', 'time_str', 'id')
+    mineral_level = 0
+    facility_selected = {'smelting': '电弧熔炉', 'assembler': '制造台MK.I', 'chemical': '化工厂', 'research': '矩阵研究站'}
+
+    def __init__(self, products, materials, time=-1, facility=None, recipe=None, relation=None, time_str=None):
+        self.products = ()      # ((thing1, count1), (thing2, count2), ...)
+        self.materials = ()
+        self.time = time
+        self.facility = None
+        self.recipe = None
+        self.relation = None
+        self.time_str = time_str
+        self.id = -1
+
+        items = []
+        for name, count in products.items():
+            thing = ThingsMgr.inst().get_thing(name)
+            thing.append_product_formula(self)
+            items.append((thing, count))
+        self.products = tuple(items)
+
+        items = []
+        for name, count in materials.items():
+            thing = ThingsMgr.inst().get_thing(name)
+            thing.append_material_formula(self)
+            items.append((thing, count))
+        self.materials = tuple(items)
+
+        if facility:
+            self.facility = ThingsMgr.inst().get_thing(facility)
+
+        if recipe:
+            self.recipe = ThingsMgr.inst().get_thing(recipe)
+            self.recipe.append_product_formula(self)
+
+        if relation:
+            self.relation = ThingsMgr.inst().get_thing(relation)
+
+    # 计算每分钟的产物、原料和设备数量，speed为每分钟产物thing的生产数量
+    def calcu_requirement(self, product, speed, check=False):
+        graph = ThingsMgr.inst().graph()
+        producer = graph.producer_index(product.id, self.id)
+        node = graph.calcu_node(producer, speed, graph.current_settings(), check)
+        if node is None:
+            return None
+        return graph.to_requirement(node, speed)
+
+
+# 按物品编号索引的每分钟数量，创建后不再改变，多个需求可以共用同一个对象
+# 物品编号和数量分别保存在两个只读的数组中，保持物品第一次出现的顺序；同一物品可以出现多次，由sum合并
+class ThingCounts(object):
+    __slots__ = ('_ids', '_counts')
+
+    def __init__(self, pairs=()):
+        pairs = pairs if isinstance(pairs, (list, tuple)) else list(pairs)
+        _set(self, '_ids', frozen(array('i', [item for item, count in pairs])))
+        _set(self, '_counts', frozen(array('d', [count for item, count in pairs])))
+
+    # ids和counts为array，复制为只读的数组，调用者之后修改它们不影响结果
+    @classmethod
+    def from_arrays(cls, ids, counts):
+        return cls.from_frozen(frozen(ids), frozen(counts))
+
+    # ids和counts为frozen返回的只读数组，可以与其他对象共用
+    @classmethod
+    def from_frozen(cls, ids, counts):
+        result = cls.__new__(cls)
+        _set(result, '_ids', ids)
+        _set(result, '_counts', counts)
+        return result
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ThingCounts创建后不能修改')
+
+    def __delattr__(self, name):
+        raise AttributeError('ThingCounts创建后不能修改')
+
+    def __reduce__(self):
+        return ThingCounts.from_arrays, (array('i', self._ids), array('d', self._counts))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def items(self):
+        return zip(self._ids, self._counts)
+
+    # [(名称, 数量), ...]
+    def named(self):
+        names = ThingsMgr.inst().graph().names
+        return [(names[item], count) for item, count in zip(self._ids, self._counts)]
+
+    # 缩放后的对象与原对象共用只读的物品编号数组
+    def scaled(self, factor):
+        if factor == 1 or not self._ids:
+            return self
+        return ThingCounts.from_frozen(self._ids, frozen(array('d', [count * factor for count in self._counts])))
+
+    # {名称: 数量}形式的数据，名称为RecipeGraph.names中的物品
+    @classmethod
+    def from_names(cls, data):
+        ids = ThingsMgr.inst().graph().ids
+        return cls((ids[name], count) for name, count in data.items())
+
+    # 一次合并多组数量，同一物品的数量相加
+    @classmethod
+    def sum(cls, all_counts):
+        totals = {}
+        for counts in all_counts:
+            for item, count in zip(counts._ids, counts._counts):
+                totals[item] = totals.get(item, 0) + count
+        return cls.from_arrays(array('i', totals), array('d', totals.values())) if totals else EMPTY_COUNTS
+
+    # 依次连接多组数量，同一物品保留多项
+    @classmethod
+    def concat(cls, all_counts):
+        ids = array('i')
+        counts = array('d')
+        for other in all_counts:
+            ids.extend(other._ids)
+            counts.extend(other._counts)
+        return cls.from_arrays(ids, counts) if ids else EMPTY_COUNTS
+
+
+_set = object.__setattr__
+
+
+# array的只读副本，元素的访问方式与array相同
+def frozen(values):
+    return memoryview(values.tobytes()).cast(values.typecode)
+
+
+EMPTY_COUNTS = ThingCounts()
+
+
+# 每分钟的需求，创建后不能修改，可以缓存或交给其他线程使用，合并和缩放都返回新的需求
+# 原料和副产物中同一物品只出现一次；设备按所属的产物分别列出，同一种设备可以出现多次
+class Requirement(object):
+    __slots__ = ('product', 'count', '_materials', '_facilities', '_byproducts')
+
+    def __init__(self, product=None, count=0, materials=EMPTY_COUNTS, facilities=EMPTY_COUNTS,
+                 byproducts=EMPTY_COUNTS):
+        _set(self, 'product', product)
+        _set(self, 'count', count)
+        _set(self, '_materials', materials)
+        _set(self, '_facilities', facilities)
+        _set(self, '_byproducts', byproducts)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Requirement创建后不能修改')
+
+    def __delattr__(self, name):
+        raise AttributeError('Requirement创建后不能修改')
+
+    def __reduce__(self):
+        return Requirement, (self.product, self.count, self._materials, self._facilities, self._byproducts)
+
+    def product_list(self):
+        if self.product:
+            return [(self.product, self.count)]
+        return []
+
+    def materials(self):
+        return dict(self._materials.named())
+
+    def materials_list(self):
+        return self._materials.named()
+
+    def byproducts(self):
+        return dict(self._byproducts.named())
+
+    def byproducts_list(self):
+        return self._byproducts.named()
+
+    def facilities(self):
+        return self._facilities.named()
+
+    # 与requirement合并后的新需求，merge为True且产物相同时合并产物数量，两者都只有一项设备时合并设备数量
+    def merged(self, requirement, merge=False):
+        count = self.count
+        facilities = ThingCounts.concat((self._facilities, requirement._facilities))
+        if merge and self.product and self.product == requirement.product:
+            count += requirement.count
+            if len(self._facilities) == 1 and len(requirement._facilities) == 1:
+                facilities = ThingCounts.from_frozen(facilities._ids[:1],
+                                                     frozen(array('d', [facilities._counts[0] + facilities._counts[1]])))
+        return Requirement(self.product, count, ThingCounts.sum((self._materials, requirement._materials)),
+                           facilities, ThingCounts.sum((self._byproducts, requirement._byproducts)))
+
+    # 一次合并多个需求的原料、设备和副产物，产物为product
+    @classmethod
+    def combine(cls, requirements, product=None, count=0):
+        return cls(product, count,
+                   ThingCounts.sum(req._materials for req in requirements),
+                   ThingCounts.concat(req._facilities for req in requirements),
+                   ThingCounts.sum(req._byproducts for req in requirements))
+
+    # 返回数量都乘以factor后的需求，factor为1时返回自身
+    def scaled(self, factor):
+        if factor == 1:
+            return self
+        return Requirement(self.product, self.count * factor, self._materials.scaled(factor),
+                           self._facilities.scaled(factor), self._byproducts.scaled(factor))
+
+    def work_consumption(self, max_=False):
+        consumption = ThingsMgr.inst().graph().work_consumption
+        total = 0
+        for facility, count in self._facilities.items():
+            if consumption[facility]:
+                total += consumption[facility] * (math.ceil(count) if max_ else count)
+        return total
+
+
+# RecipeGraph.solve_incremental的求解结果，记录每个节点依赖的设置，设置改变后只重新计算受影响的节点
+class Solution(object):
+    def __init__(self, demands, settings):
+        self.demands = dict(demands)
+        self.settings = settings
+        self.totals = {}            # {物品: 每分钟的总需求}
+        self.nodes = {}             # {物品: RecipeGraph.calcu_node的结果或None}
+        self.levels = []            # 同RecipeGraph.solve的返回值
+        self.dependents = {}        # {('formula', 物品) | ('facility', 设备类型) | ('mineral',): {依赖该设置的物品}}
+        self.recomputed = set()     # 本次重新计算了节点的物品，其余节点沿用上一次的结果
+
+    def depend(self, key, item):
+        items = self.dependents.get(key)
+        if items is None:
+            items = self.dependents[key] = set()
+        items.add(item)
+
+
+# 加载完成后编译出的整数编号公式图，物品和公式按加载顺序编号，数组均为CSR形式
+class RecipeGraph(object):
+    def __init__(self, things, formulas):
+        self.things = list(things)
+        self.formulas = list(formulas)
+        self.names = [thing.name for thing in self.things]
+        self.ids = {}
+        for index, thing in enumerate(self.things):
+            thing.id = index
+            self.ids[thing.name] = index
+        for index, formula in enumerate(self.formulas):
+            formula.id = index
+
+        # 物品属性
+        self.exclude = array('b', (1 if thing.exclude else 0 for thing in self.things))
+        buildings = [thing if isinstance(thing, Building) else None for thing in self.things]
+        self.origin = array('b', (1 if building and building.origin else 0 for building in buildings))
+        self.mineral = array('b', (1 if building and building.mineral else 0 for building in buildings))
+        self.production_speed = array('d', (building and building.production_speed or 1 for building in buildings))
+        self.work_consumption = array('d', (building and building.work_consumption or 0 for building in buildings))
+        self.facility_type = [building.facility_type if building else None for building in buildings]
+
+        # 公式属性，公式两边的物品和数量
+        self.formula_time = array('d')
+        self.formula_facility = array('i')
+        self.product_ptr = array('i', [0])
+        self.product_item = array('i')
+        self.product_coef = array('d')
+        self.material_ptr = array('i', [0])
+        self.material_item = array('i')
+        self.material_coef = array('d')
+        for formula in self.formulas:
+            has_time = isinstance(formula.time, (int, float)) and formula.time > 0
+            self.formula_time.append(formula.time if has_time else 0)
+            self.formula_facility.append(formula.facility.id)
+            for thing, count in formula.products:
+                self.product_item.append(thing.id)
+                self.product_coef.append(count)
+            self.product_ptr.append(len(self.product_item))
+            for thing, count in formula.materials:
+                self.material_item.append(thing.id)
+                self.material_coef.append(count)
+            self.material_ptr.append(len(self.material_item))
+
+        # 生产每个物品的公式，producer_item为实际的产物（配方对应的物品），producer_coef为该产物的数量
+        self.producer_ptr = array('i', [0])
+        self.producer_formula = array('i')
+        self.producer_item = array('i')
+        self.producer_coef = array('d')
+        for thing in self.things:
+            for formula in thing.product_formulas():
+                product = formula.relation if formula.recipe == thing else thing
+                self.producer_formula.append(formula.id)
+                self.producer_item.append(product.id)
+                self.producer_coef.append(self.product_count(formula.id, product.id))
+            self.producer_ptr.append(len(self.producer_formula))
+
+        # 公式图中的循环，在所有可选公式构成的图上求出，任何设置下出现的循环都包含在其中
+        self.loop_of = array('i', [-1]) * len(self.things)     # 物品所在循环的编号，不在循环中为-1
+        self.loops = []                                         # [(物品1, 物品2, ...), ...]，物品按编号排序
+        self.find_loops()
+
+    def product_count(self, formula, item):
+        for index in range(self.product_ptr[formula], self.product_ptr[formula + 1]):
+            if self.product_item[index] == item:
+                return self.product_coef[index]
+        return None
+
+    # 用Tarjan算法求出所有可选公式构成的图的强连通分量，包含多个物品或物品以自身为原料的分量为循环
+    def find_loops(self):
+        count = len(self.things)
+        children = []
+        for item in range(count):
+            items = set()
+            for producer in range(self.producer_ptr[item], self.producer_ptr[item + 1]):
+                formula = self.producer_formula[producer]
+                if self.exclude[self.producer_item[producer]] or self.origin[self.formula_facility[formula]]:
+                    continue
+                items.update(self.material_item[self.material_ptr[formula]:self.material_ptr[formula + 1]])
+            children.append(items)
+
+        index = array('i', [-1]) * count
+        low = array('i', [0]) * count
+        on_stack = bytearray(count)
+        stack = []
+        counter = 0
+        for root in range(count):
+            if index[root] >= 0:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [(root, iter(children[root]))]
+            while work:
+                item, items = work[-1]
+                for child in items:
+                    if index[child] < 0:
+                        index[child] = low[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        on_stack[child] = 1
+                        work.append((child, iter(children[child])))
+                        break
+                    if on_stack[child]:
+                        low[item] = min(low[item], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[item])
+                    if low[item] != index[item]:
+                        continue
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        members.append(member)
+                        if member == item:
+                            break
+                    if len(members) > 1 or item in children[item]:
+                        for member in members:
+                            self.loop_of[member] = len(self.loops)
+                        self.loops.append(tuple(sorted(members)))
+
+    def producer_index(self, item, formula):
+        for index in range(self.producer_ptr[item], self.producer_ptr[item + 1]):
+            if self.producer_formula[index] == formula:
+                return index
+        return -1
+
+    # 当前的设置：每个物品选择的公式在producer数组中的位置、每种设备类型选择的设备和矿物利用等级
+    def current_settings(self):
+        selected = array('i')
+        for thing in self.things:
+            formula = thing.selected_formula()
+            if formula is None:
+                selected.append(-1)
+            else:
+                selected.append(self.producer_ptr[thing.id] + thing.product_formulas().index(formula))
+        facilities = {}
+        for facility_type, name in Formula.facility_selected.items():
+            facilities[facility_type] = self.ids[name]
+        return selected, facilities, Formula.mineral_level
+
+    # 在base（默认为当前设置）的基础上修改得到新的设置，不改变Formula和Thing中保存的设置
+    # mineral_level为非负整数，facilities为{设备类型: 设备名称}，formulas为{物品名称: 公式序号或配方名称}
+    # 参数的类型不对时抛出TypeError，取值不对时抛出ValueError
+    def make_settings(self, mineral_level=None, facilities=None, formulas=None, base=None):
+        for name, value in (('facilities', facilities), ('formulas', formulas)):
+            if value is not None and not isinstance(value, Mapping):
+                raise TypeError('%s应为对象：%s' % (name, value))
+        selected, facility_ids, level = base or self.current_settings()
+        selected = array('i', selected)
+        facility_ids = dict(facility_ids)
+        if mineral_level is not None:
+            if isinstance(mineral_level, str) and mineral_level.strip().isdigit():
+                mineral_level = int(mineral_level)
+            if not isinstance(mineral_level, int) or isinstance(mineral_level, bool) or mineral_level < 0:
+                raise ValueError('矿物利用等级应为非负整数：%s' % mineral_level)
+            level = mineral_level
+
+        for facility_type, name in (facilities or {}).items():
+            if facility_type not in facility_ids:
+                raise ValueError('未知的设备类型：%s' % facility_type)
+            facility = self.ids.get(name)
+            if facility is None or self.facility_type[facility] != facility_type:
+                raise ValueError('%s不是%s类型的设备' % (name, facility_type))
+            facility_ids[facility_type] = facility
+
+        for name, value in (formulas or {}).items():
+            item = self.ids.get(name)
+            if item is None:
+                raise ValueError('未知的物品：%s' % name)
+            producers = range(self.producer_ptr[item], self.producer_ptr[item + 1])
+            if isinstance(value, int) or str(value).isdigit():
+                index = int(value)
+            else:
+                index = -1
+                for pos, producer in enumerate(producers):
+                    recipe = self.formulas[self.producer_formula[producer]].recipe
+                    if recipe and recipe.name == value:
+                        index = pos
+            if not 0 <= index < len(producers):
+                raise ValueError('%s没有公式%s' % (name, value))
+            selected[item] = producers[index]
+
+        return selected, facility_ids, level
+
+    # 设置的指纹，设置相同时求解结果相同
+    def fingerprint(self, settings):
+        selected, facilities, mineral_level = settings
+        return selected.tobytes(), tuple(sorted(facilities.items())), mineral_level
+
+    # 物品item需要继续展开时返回所用公式在producer数组中的位置，否则返回-1
+    def expand_index(self, item, settings):
+        producer = settings[0][item]
+        if producer < 0:
+            return -1
+        facility = self.formula_facility[self.producer_formula[producer]]
+        if self.exclude[self.producer_item[producer]] or self.origin[facility]:
+            return -1
+        return producer
+
+    # 与单个产物的计算相同，目标物品本身不展开（排除的物品或原矿）但有公式时，只按所选公式计算一次，
+    # 它的原料都作为原料，不再展开。返回(其余目标的需求, [(目标, 数量, 节点), ...])
+    def expand_targets(self, demands, settings):
+        expanded = {}
+        roots = []
+        for item, count in demands.items():
+            producer = settings[0][item]
+            if producer < 0 or self.expand_index(item, settings) >= 0:
+                expanded[item] = expanded.get(item, 0) + count
+            else:
+                roots.append((item, count, self.calcu_node(producer, count, settings)))
+        return expanded, roots
+
+    # 只计算一次的目标的原料，返回[(原料, 数量, None), ...]，放在第二层
+    @staticmethod
+    def root_materials(roots):
+        return [(material, material_count, None) for item, count, node in roots for material, material_count in node[3]]
+
+    # 用producer位置的公式每分钟生产speed个产物，返回(产物, 设备, 设备数量, [(原料, 数量), ...])
+    def calcu_node(self, producer, speed, settings, check=False):
+        if producer < 0:
+            return None
+        formula = self.producer_formula[producer]
+        product = self.producer_item[producer]
+        product_count = self.producer_coef[producer]
+        facility = self.formula_facility[formula]
+        if check and (self.exclude[product] or self.origin[facility]):
+            return None
+
+        facility_count = (speed * self.formula_time[formula]) / (product_count * 60.0)
+        if self.mineral[facility]:
+            facility_count = facility_count / (1 + 0.1 * settings[2])
+
+        facility_type = self.facility_type[facility]
+        if facility_type in settings[1]:
+            facility = settings[1][facility_type]
+            facility_count = facility_count / self.production_speed[facility]
+
+        materials = []
+        for index in range(self.material_ptr[formula], self.material_ptr[formula + 1]):
+            materials.append((self.material_item[index], self.material_coef[index] * speed / product_count))
+        return product, facility, facility_count, materials
+
+    # 对从items出发需要展开的物品进行拓扑排序，每个物品都排在使用它作为原料的物品之后
+    # 同一循环中的物品作为一个整体排序，在结果中连续排列
+    def sort(self, items, settings):
+        reached = self.reachable(items, settings) if self.loops else None
+        order = []
+        state = {}      # 1 访问中，2 已完成，循环用-1-循环编号表示
+        for root in items:
+            root = self.block_of(root)
+            if root in state:
+                continue
+            state[root] = 1
+            stack = [(root, self.block_children(root, settings, reached))]
+            while stack:
+                block, children = stack[-1]
+                for child in children:
+                    if child not in state:
+                        state[child] = 1
+                        stack.append((child, self.block_children(child, settings, reached)))
+                        break
+                else:
+                    stack.pop()
+                    state[block] = 2
+                    if block >= 0:
+                        order.append(block)
+                    else:
+                        order.extend(item for item in reversed(self.loops[-1 - block]) if item in reached)
+        order.reverse()
+        return order
+
+    # 从items出发需要展开的所有物品
+    def reachable(self, items, settings):
+        reached = set(items)
+        stack = list(reached)
+        while stack:
+            for child in self.material_children(stack.pop(), settings):
+                if child not in reached:
+                    reached.add(child)
+                    stack.append(child)
+        return reached
+
+    def block_of(self, item):
+        loop = self.loop_of[item]
+        return item if loop < 0 else -1 - loop
+
+    # 排序时物品或循环的原料，循环的原料为其中各物品在循环外的原料
+    def block_children(self, block, settings, reached):
+        if block >= 0:
+            members = (block,)
+        else:
+            members = [item for item in self.loops[-1 - block] if item in reached]
+        for item in members:
+            for child in self.material_children(item, settings):
+                child = self.block_of(child)
+                if child != block:
+                    yield child
+
+    # 把sort的结果分为连续的块，返回[(循环编号或-1, [物品, ...]), ...]
+    def blocks(self, order):
+        blocks = []
+        for item in order:
+            loop = self.loop_of[item]
+            if loop >= 0 and blocks and blocks[-1][0] == loop:
+                blocks[-1][1].append(item)
+            else:
+                blocks.append((loop, [item]))
+        return blocks
+
+    # 循环的稳态：每分钟的总产量x满足 x = inflow + A·x，A[i][j]为每生产一个物品j消耗的循环内物品i，
+    # 即求解(I - A)·x = inflow。返回(I - A)，members为循环中需要展开的物品
+    def loop_matrix(self, members, settings):
+        position = {item: pos for pos, item in enumerate(members)}
+        matrix = [[1.0 if row == col else 0.0 for col in range(len(members))] for row in range(len(members))]
+        for col, item in enumerate(members):
+            node = self.calcu_node(self.expand_index(item, settings), 1.0, settings)
+            for material, count in (node[3] if node else ()):
+                if material in position:
+                    matrix[position[material]][col] -= count
+        return matrix
+
+    # 用高斯消元法求出循环中各物品的总产量，循环消耗的物品不少于产出时抛出ValueError
+    def solve_loop(self, members, inflow, settings):
+        matrix = self.loop_matrix(members, settings)
+        size = len(members)
+        values = list(inflow)
+        for col in range(size):
+            pivot = max(range(col, size), key=lambda row: abs(matrix[row][col]))
+            if abs(matrix[pivot][col]) < 1e-12:
+                raise ValueError('合成公式循环无法产出：%s' % '、'.join(self.names[item] for item in members))
+            matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+            values[col], values[pivot] = values[pivot], values[col]
+            for row in range(col + 1, size):
+                factor = matrix[row][col] / matrix[col][col]
+                if factor:
+                    for pos in range(col, size):
+                        matrix[row][pos] -= factor * matrix[col][pos]
+                    values[row] -= factor * values[col]
+        for col in reversed(range(size)):
+            values[col] = (values[col] - sum(matrix[col][pos] * values[pos] for pos in range(col + 1, size))) \
+                / matrix[col][col]
+        if any(value < -1e-9 * max(1, max(inflow)) for value in values):
+            raise ValueError('合成公式循环无法产出：%s' % '、'.join(self.names[item] for item in members))
+        return [max(value, 0) for value in values]
+
+    def material_children(self, item, settings):
+        producer = self.expand_index(item, settings)
+        if producer < 0:
+            return iter(())
+        formula = self.producer_formula[producer]
+        return iter(self.material_item[self.material_ptr[formula]:self.material_ptr[formula + 1]])
+
+    # 按拓扑顺序一次性汇总每个物品的总需求，物品所在的层级为它到目标产物的最长路径
+    # 不展开的目标按expand_targets只计算一次，排在第一层，它的原料排在第二层
+    # 返回[[(物品, 数量, 节点或None), ...], ...]
+    def solve(self, demands, settings=None):
+        return self.solve_incremental(demands, settings).levels
+
+    # 与solve相同，返回Solution。previous为相同需求在其他设置下的求解结果时，只重新计算受影响的节点：
+    # 公式改变的物品及其在新旧设置下的所有原料数量都会变化，需要重新计算；
+    # 设备类型或矿物利用等级改变只影响使用它们的节点的设备数量，不影响原料数量
+    def solve_incremental(self, demands, settings=None, previous=None):
+        if settings is None:
+            settings = self.current_settings()
+        demands, roots = self.expand_targets(demands, settings)
+        solution = Solution(demands, settings)
+        if roots:
+            solution.levels.append(list(roots))
+        order = self.sort(demands, settings)
+        if previous is None or previous.demands != solution.demands:
+            affected = set(order)
+            refresh = set()
+        else:
+            affected, refresh = self.settings_changes(previous, settings)
+
+        # 循环中的物品互相影响，有一个受影响时整个循环都需要重新求解
+        loops = {self.loop_of[item] for item in affected if self.loop_of[item] >= 0}
+        if loops:
+            affected.update(item for item in order if self.loop_of[item] in loops)
+
+        totals = solution.totals
+        nodes = solution.nodes
+        for item in order:
+            if item in affected:
+                totals[item] = demands.get(item, 0)
+            else:
+                totals[item] = previous.totals[item]
+                nodes[item] = previous.nodes[item]
+        # 数量不变的节点对数量改变的原料的贡献
+        for item in order:
+            node = nodes.get(item)
+            if node:
+                for material, material_count in node[3]:
+                    if material in affected:
+                        totals[material] = totals[material] + material_count
+
+        levels = dict.fromkeys(demands, 0)
+        for loop, block in self.blocks(order):
+            # 循环外流入的需求已经累加完成，求出循环的总产量，循环内部的消耗不再累加
+            if loop >= 0 and block[0] in affected:
+                for item, count in zip(block, self.solve_loop(block, [totals[item] for item in block], settings)):
+                    totals[item] = count
+            level = max(levels.get(item, 0) for item in block)
+            for item in block:
+                count = totals[item]
+                if item in affected or item in refresh:
+                    node = self.calcu_node(self.expand_index(item, settings), count, settings)
+                    nodes[item] = node
+                    solution.recomputed.add(item)
+                    if node and item in affected:
+                        for material, material_count in node[3]:
+                            if loop < 0 or self.loop_of[material] != loop:
+                                totals[material] = totals[material] + material_count
+                else:
+                    node = nodes[item]
+                if node:
+                    self.record_dependents(solution, item, settings)
+                    for material, material_count in node[3]:
+                        if loop < 0 or self.loop_of[material] != loop:
+                            levels[material] = max(levels.get(material, 0), level + 1)
+
+                if level >= len(solution.levels):
+                    solution.levels.append([])
+                solution.levels[level].append((item, count, node))
+
+        if roots:
+            if len(solution.levels) < 2:
+                solution.levels.append([])
+            solution.levels[1].extend(self.root_materials(roots))
+        return solution
+
+    # 记录item的节点依赖的设置：所用公式、设备类型的选择和矿物利用等级
+    def record_dependents(self, solution, item, settings):
+        solution.depend(('formula', item), item)
+        facility = self.formula_facility[self.producer_formula[settings[0][item]]]
+        if self.facility_type[facility] in settings[1]:
+            solution.depend(('facility', self.facility_type[facility]), item)
+        if self.mineral[facility]:
+            solution.depend(('mineral',), item)
+
+    # 从previous.settings变为settings时受影响的物品，返回(数量会变化的物品, 只需要重新计算设备的物品)
+    def settings_changes(self, previous, settings):
+        old_selected, old_facilities, old_level = previous.settings
+        selected, facilities, mineral_level = settings
+        changed = [item for item in previous.nodes if old_selected[item] != selected[item]]
+
+        # 公式改变的物品在旧设置和新设置下的所有下游物品
+        affected = set(changed)
+        stack = list(changed)
+        while stack:
+            node = previous.nodes.get(stack.pop())
+            for material, material_count in (node[3] if node else ()):
+                if material not in affected:
+                    affected.add(material)
+                    stack.append(material)
+        affected.update(self.sort(changed, settings))
+
+        refresh = set()
+        for facility_type in set(old_facilities) | set(facilities):
+            if old_facilities.get(facility_type) != facilities.get(facility_type):
+                refresh.update(previous.dependents.get(('facility', facility_type), ()))
+        if old_level != mineral_level:
+            refresh.update(previous.dependents.get(('mineral',), ()))
+        return affected, refresh
+
+    # 批量计算多个生产计划，rates[i][j]为第i个计划中targets[j]每分钟的生产数量
+    # 所有计划一起按拓扑顺序遍历一次公式图，不展开的目标与calcu_requirements相同，只按所选公式计算一次
+    # 返回(各物品的总需求, 各设备的数量, 各计划的工作功率)
+    # 前两者的形状为(计划数, 物品数)，按物品编号索引
+    def solve_batch(self, targets, rates, settings=None):
+        load_numpy('批量计算')
+        if settings is None:
+            settings = self.current_settings()
+        rates = numpy.atleast_2d(numpy.asarray(rates, dtype=float))
+        if rates.shape[1] != len(targets):
+            raise ValueError('rates的列数与targets的数量不一致')
+
+        demands = numpy.zeros((rates.shape[0], len(self.things)))
+        facilities = numpy.zeros_like(demands)
+        items = []      # 需要排序的物品，不展开的目标按expand_targets只计算一次，不参与排序
+        roots = []      # [(列, 节点), ...]
+        for col, item in enumerate(targets):
+            demands[:, item] += rates[:, col]
+            expanded, item_roots = self.expand_targets({item: 1.0}, settings)
+            items.extend(expanded)
+            roots.extend((col, node) for root, count, node in item_roots)
+
+        for loop, block in self.blocks(self.sort(items, settings)):
+            if loop >= 0:
+                try:
+                    gross = numpy.linalg.solve(numpy.array(self.loop_matrix(block, settings)), demands[:, block].T).T
+                except numpy.linalg.LinAlgError:
+                    gross = None
+                if gross is None or (gross < -1e-9 * max(1, demands[:, block].max())).any():
+                    raise ValueError('合成公式循环无法产出：%s' % '、'.join(self.names[item] for item in block))
+                demands[:, block] = numpy.maximum(gross, 0)
+            for item in block:
+                node = self.calcu_node(self.expand_index(item, settings), 1.0, settings)
+                if node is None:
+                    continue
+                product, facility, facility_count, materials = node
+                facilities[:, facility] += demands[:, item] * facility_count
+                for material, count in materials:
+                    if loop < 0 or self.loop_of[material] != loop:
+                        demands[:, material] += demands[:, item] * count
+
+        # 只计算一次的目标的原料在其他物品展开之后再计入，不再展开
+        for col, node in roots:
+            facilities[:, node[1]] += rates[:, col] * node[2]
+            for material, material_count in node[3]:
+                demands[:, material] += rates[:, col] * material_count
+
+        return demands, facilities, facilities.dot(numpy.asarray(self.work_consumption))
+
+    # producer位置的公式每分钟生产count个产物时的其他产物，返回[(物品, 数量), ...]
+    def byproducts(self, producer, count):
+        formula = self.producer_formula[producer]
+        runs = count / self.producer_coef[producer]
+        return [(self.product_item[pos], self.product_coef[pos] * runs)
+                for pos in range(self.product_ptr[formula], self.product_ptr[formula + 1])
+                if self.product_item[pos] != self.producer_item[producer]]
+
+    # byproducts为[(物品, 数量), ...]
+    def to_requirement(self, node, speed, byproducts=()):
+        product, facility, facility_count, materials = node
+        return Requirement(self.names[product], speed, ThingCounts(materials),
+                           ThingCounts.from_arrays(array('i', [facility]), array('d', [facility_count])),
+                           ThingCounts(byproducts) if byproducts else EMPTY_COUNTS)
+
+
+# 基于numpy的公式矩阵求解，一次线性代数运算得到各公式的运行速度，副产物会抵扣其他环节的需求
+class MatrixSolver(object):
+    def __init__(self, graph):
+        load_numpy('矩阵求解')
+        self._graph = graph
+
+    # 返回(物品列表, [(物品, 公式位置), ...], 各公式的生产次数, 各物品的净产出)
+    # 公式由使用它的物品占据一行，配方物品单独占据一行，净产出大于0为剩余，小于0为需要的原料
+    def solve(self, demands, settings):
+        graph = self._graph
+        items = graph.sort(demands, settings)
+        columns = []
+        for item in items:
+            producer = graph.expand_index(item, settings)
+            if producer >= 0:
+                columns.append((item, producer))
+
+        index = {item: row for row, item in enumerate(items)}
+        for item, producer in columns:
+            formula = graph.producer_formula[producer]
+            for pos in range(graph.product_ptr[formula], graph.product_ptr[formula + 1]):
+                index.setdefault(graph.product_item[pos], len(index))
+
+        matrix = numpy.zeros((len(index), len(columns)))
+        for col, (item, producer) in enumerate(columns):
+            formula = graph.producer_formula[producer]
+            for pos in range(graph.product_ptr[formula], graph.product_ptr[formula + 1]):
+                product = graph.product_item[pos]
+                row = index[item] if product == graph.producer_item[producer] else index[product]
+                matrix[row, col] += graph.product_coef[pos]
+            for pos in range(graph.material_ptr[formula], graph.material_ptr[formula + 1]):
+                matrix[index[graph.material_item[pos]], col] -= graph.material_coef[pos]
+
+        demand = numpy.zeros(len(index))
+        for item, count in demands.items():
+            demand[index[item]] += count
+
+        # 副产物超过需求时对应的公式不再运行，去掉这些公式后重新求解
+        owned = numpy.array([index[item] for item, producer in columns], dtype=int)
+        active = numpy.ones(len(columns), dtype=bool)
+        rates = numpy.zeros(len(columns))
+        while active.any():
+            rates[:] = 0
+            sub_matrix = matrix[numpy.ix_(owned[active], active)]
+            rates[active] = numpy.linalg.lstsq(sub_matrix, demand[owned[active]], rcond=None)[0]
+            negative = active & (rates < -1e-9)
+            if not negative.any():
+                break
+            active &= ~negative
+
+        rates = numpy.maximum(rates, 0)
+        items = sorted(index, key=index.get)
+        return items, columns, rates, matrix.dot(rates) - demand
+
+    # 与ThingsMgr.calcu_all_requirements的结果格式相同，另外返回净需求的原料和剩余的副产物
+    def calcu_all_requirements(self, products, settings=None):
+        graph = self._graph
+        if settings is None:
+            settings = graph.current_settings()
+        demands, roots = graph.expand_targets({graph.ids[name]: count for name, count in products.items()}, settings)
+        items, columns, rates, net = self.solve(demands, settings)
+
+        order = graph.sort(demands, settings)
+        position = {item: pos for pos, item in enumerate(order)}
+        levels = dict.fromkeys(demands, 0)
+        for item in order:
+            for child in graph.material_children(item, settings):
+                if position[child] > position[item]:
+                    levels[child] = max(levels.get(child, 0), levels[item] + 1)
+
+        requirements = {}
+        for col, (item, producer) in enumerate(columns):
+            count = rates[col] * graph.producer_coef[producer]
+            req = graph.to_requirement(graph.calcu_node(producer, count, settings), count,
+                                       graph.byproducts(producer, count))
+            requirements[item] = (count, req)
+
+        # 只计算一次的目标与单个产物的计算相同，不参与矩阵求解，原料直接计入原料
+        materials = {}
+        byproducts = {}
+        all_requirements = [[(graph.names[item], count, graph.to_requirement(node, count))
+                             for item, count, node in roots]] if roots else []
+        tolerance = 1e-9 * max(1, sum(products.values()))
+        for row, item in enumerate(items):
+            if net[row] > tolerance:
+                byproducts[graph.names[item]] = byproducts.get(graph.names[item], 0) + float(net[row])
+            elif net[row] < -tolerance and item not in requirements:
+                materials[graph.names[item]] = float(-net[row])
+                requirements[item] = (float(-net[row]), None)
+
+        for item in order:
+            if item not in requirements:
+                continue
+            level = levels[item]
+            while level >= len(all_requirements):
+                all_requirements.append([])
+            count, req = requirements[item]
+            all_requirements[level].append((graph.names[item], float(count), req))
+
+        if roots:
+            if len(all_requirements) < 2:
+                all_requirements.append([])
+            for item, count, node in graph.root_materials(roots):
+                materials[graph.names[item]] = materials.get(graph.names[item], 0) + count
+                all_requirements[1].append((graph.names[item], count, None))
+        return all_requirements, materials, byproducts
+
+
+class ThingsMgr(object):
+    _inst = None
+    backends = ('topological', 'matrix')
+    cache_size = 128
+
+    def __init__(self):
+        self._all_things = {}
+        self._components = {}
+        self._others = {}
+        self._buildings = {}
+        self._items = {}
+        self._all_formulas = []
+        self._graph = None
+        self.backend = 'topological'
+        self._requirement_cache = OrderedDict()    # {(设置指纹, 求解方式, 产物): 每分钟1个产物的需求}
+        self._solutions = OrderedDict()             # {产物: 最近一次的Solution}，用于设置改变后增量求解
+        self._cache_lock = threading.Lock()         # 界面在后台线程中计算，缓存可能被多个线程同时访问
+
+    @traced()
+    def load_things(self, folder=FILES_FOLDER):
+        with open(os.path.join(folder, 'Components.json'), 'r', encoding='utf-8') as file:
+            for name, data in json.load(file).items():
+                self._components[name] = Thing(name, **data)
+
+        with open(os.path.join(folder, 'OtherComponents.json'), 'r', encoding='utf-8') as file:
+            for name, data in json.load(file).items():
+                self._others[name] = Thing(name, **data)
+
+        with open(os.path.join(folder, 'Buildings.json'), 'r', encoding='utf-8') as file:
+            for name, data in json.load(file).items():
+                self._buildings[name] = Building(name, **data)
+
+        self._items.update(self._components)
+        self._items.update(self._others)
+        self._all_things.update(self._components)
+        self._all_things.update(self._buildings)
+        self._all_things.update(self._others)
+
+    @traced()
+    def load_formulas(self, folder=FILES_FOLDER):
+        with open(os.path.join(folder, 'Formulas.json'), 'r', encoding='utf-8') as file:
+            for data in json.load(file):
+                self._all_formulas.append(Formula(**data))
+
+        self._graph = RecipeGraph(self._all_things.values(), self._all_formulas)
+
+    def graph(self):
+        return self._graph
+
+    def all_things(self):
+        return self._all_things
+
+    def components(self):
+        return self._components
+
+    def buildings(self):
+        return self._buildings
+
+    def others(self):
+        return self._others
+
+    def get_thing(self, name):
+        thing = self._all_things.get(name)
+        if thing is None:
+            print('get_thing', name, file=sys.stderr)
+        return thing
+
+    def get_multi_formula_things(self):
+        temp = []
+        for thing in self._all_things.values():
+            if len(thing.product_formulas()) > 1:
+                temp.append(thing)
+        return temp
+
+    def get_by_facility_type(self, facility_type):
+        temp = []
+        for thing in self._buildings.values():
+            if facility_type == thing.facility_type:
+                temp.append(thing)
+        return temp
+
+    # backend为'topological'时逐级累加需求，为'matrix'时用MatrixSolver求解并抵扣副产物
+    # 需求与speed成正比，按设置指纹缓存每分钟1个产物的结果，再乘以speed得到结果
+    # settings为RecipeGraph.current_settings或make_settings的返回值，默认使用当前设置
+    @traced()
+    def calcu_requirements(self, product, speed, backend=None, settings=None):
+        if settings is None:
+            settings = self._graph.current_settings()
+        if settings[0][product.id] < 0:
+            return None
+
+        backend = backend or self.backend
+        if backend not in self.backends:
+            raise ValueError('未知的求解方式：%s' % backend)
+
+        key = (self._graph.fingerprint(settings), backend, product.id)
+        with self._cache_lock:
+            unit_requirements = self._requirement_cache.get(key)
+            if unit_requirements is not None:
+                self._requirement_cache.move_to_end(key)
+        if unit_requirements is None:
+            with span('ThingsMgr.solve_requirements', product=product.name, backend=backend):
+                unit_requirements = self.solve_requirements(product, 1, backend, settings)
+            with self._cache_lock:
+                self._requirement_cache[key] = unit_requirements
+                if len(self._requirement_cache) > self.cache_size:
+                    self._requirement_cache.popitem(last=False)
+
+        current_requirement_list, different_requirements = unit_requirements
+        return [req.scaled(speed) for req in current_requirement_list], \
+            [req.scaled(speed) for req in different_requirements]
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._requirement_cache.clear()
+            self._solutions.clear()
+
+    # 以同一产物上一次的求解结果为基础增量求解
+    def solve_levels(self, product, speed, settings=None):
+        with self._cache_lock:
+            previous = self._solutions.get(product.id)
+        solution = self._graph.solve_incremental({product.id: speed}, settings, previous)
+        with self._cache_lock:
+            self._solutions[product.id] = solution
+            self._solutions.move_to_end(product.id)
+            if len(self._solutions) > self.cache_size:
+                self._solutions.popitem(last=False)
+        return solution.levels
+
+    def solve_requirements(self, product, speed, backend, settings=None):
+        if settings is None:
+            settings = self._graph.current_settings()
+        net_materials = net_byproducts = None
+        if backend == 'matrix':
+            result, net_materials, net_byproducts = MatrixSolver(self._graph).calcu_all_requirements(
+                {product.name: speed}, settings)
+        else:
+            result = self.levels_requirements(self.solve_levels(product, speed, settings))
+
+        # 不展开的产物只展开一次，原料都不再展开时只有产物自身的需求
+        if self._graph.expand_index(product.id, settings) < 0 and \
+                not any(data[2] for current_result in result[1:] for data in current_result):
+            return [result[0][0][2]], []
+        return self.assemble_requirements(result, Requirement(product.name, speed), net_materials, net_byproducts)
+
+    # 把各层的需求汇总为(各层需求+总需求, 各产物需求+空行+各产物合并后的total)
+    # net_materials和net_byproducts为矩阵求解得到的净原料和剩余副产物，为None时由各层需求累加
+    # total只提供总需求的产物和数量；返回的需求都是新建的，result中的需求不会被修改
+    def assemble_requirements(self, result, total, net_materials=None, net_byproducts=None):
+        ids = self._graph.ids
+        current_requirement_list = []
+        different_requirements = {}     # {产物: 产物的需求，同一产物出现多次时合并}
+        all_requirements = []
+        leaves = []                     # 不再展开的物品即为原料
+        for current_result in result:
+            requirements = [data[2] for data in current_result if data[2]]
+            current_requirement_list.append(Requirement.combine(requirements))
+            all_requirements.extend(requirements)
+            for req in requirements:
+                if req.product in different_requirements:
+                    different_requirements[req.product] = different_requirements[req.product].merged(req, True)
+                else:
+                    different_requirements[req.product] = req
+            leaves.extend((ids[data[0]], data[1]) for data in current_result if not data[2])
+
+        different_requirements = list(different_requirements.values())
+        if net_materials is None:
+            materials = ThingCounts.sum([ThingCounts(leaves)])
+            byproducts = ThingCounts.sum(req._byproducts for req in all_requirements)
+        else:
+            materials = ThingCounts.from_names(net_materials)
+            byproducts = ThingCounts.from_names(net_byproducts)
+        current_requirement_list.append(Requirement(None, 0, materials, ThingCounts.concat(
+            req._facilities for req in different_requirements), byproducts))
+
+        total = Requirement.combine(different_requirements, total.product, total.count)
+        different_requirements.append(Requirement())
+        different_requirements.append(total)
+        return current_requirement_list, different_requirements
+
+    # 工厂规划：products为{物品名称: 每分钟产量}，所有产物一起展开求解一次，
+    # 共用的中间产物只计算一次并合并数量，返回值的格式与calcu_requirements相同，总需求中不包含产物
+    @traced()
+    def calcu_plan(self, products, backend=None, settings=None):
+        graph = self._graph
+        if settings is None:
+            settings = graph.current_settings()
+        backend = backend or self.backend
+        if backend not in self.backends:
+            raise ValueError('未知的求解方式：%s' % backend)
+
+        products = {name: float(speed) for name, speed in products.items() if float(speed) > 0}
+        if not products:
+            raise ValueError('没有需要生产的物品')
+        for name in products:
+            item = graph.ids.get(name)
+            if item is None:
+                raise ValueError('未知的物品：%s' % name)
+            if settings[0][item] < 0:
+                raise ValueError('%s没有合成公式' % name)
+
+        net_materials = net_byproducts = None
+        if backend == 'matrix':
+            result, net_materials, net_byproducts = MatrixSolver(graph).calcu_all_requirements(products, settings)
+        else:
+            result = self.calcu_all_requirements(products, settings)
+        return self.assemble_requirements(result, Requirement(), net_materials, net_byproducts)
+
+    # 计算结果汇总为只包含名称和数字的dict，用于输出JSON
+    def calcu_summary(self, product, speed, backend=None, settings=None):
+        result = self.calcu_requirements(product, speed, backend, settings)
+        if result is None:
+            return None
+        summary = {'target': product.name, 'speed': speed}
+        summary.update(self.summarize(result, {product.name: speed}))
+        return summary
+
+    # 工厂规划的汇总，products为{物品名称: 每分钟产量}
+    def calcu_plan_summary(self, products, backend=None, settings=None):
+        summary = {'targets': dict(products)}
+        summary.update(self.summarize(self.calcu_plan(products, backend, settings), products))
+        return summary
+
+    # targets为{物品名称: 每分钟产量}，结果中没有产物时作为产物输出
+    def summarize(self, result, targets=None):
+        current_requirement_list, different_requirements = result
+        final_requirement = current_requirement_list[-1]
+        facilities = {}
+        for name, count in final_requirement.facilities():
+            facilities[name] = facilities.get(name, 0) + count
+        products = {}
+        for req in different_requirements[:-2] or current_requirement_list:
+            if req.product:
+                products[req.product] = products.get(req.product, 0) + req.count
+        if not products and targets:
+            products = {name: float(speed) for name, speed in targets.items()}
+        return {
+            'materials': final_requirement.materials(),
+            'facilities': facilities,
+            'byproducts': final_requirement.byproducts(),
+            'products': products,
+            'work_consumption': final_requirement.work_consumption(),
+        }
+
+    # targets为物品名称列表，rates为(计划数, len(targets))的矩阵，结果见RecipeGraph.solve_batch
+    def calcu_batch_requirements(self, targets, rates):
+        graph = self._graph
+        return graph.solve_batch([graph.ids[name] for name in targets], rates)
+
+    def calcu_all_requirements(self, products, settings=None):
+        graph = self._graph
+        demands = {graph.ids[name]: count for name, count in products.items()}
+        return self.levels_requirements(graph.solve(demands, settings))
+
+    # 把RecipeGraph.solve的结果转换为[[(名称, 数量, Requirement或None), ...], ...]
+    def levels_requirements(self, levels):
+        graph = self._graph
+        all_requirements = []
+        for nodes in levels:
+            requirements = []
+            for item, count, node in nodes:
+                req = graph.to_requirement(node, count) if node else None
+                requirements.append((graph.names[item], count, req))
+            all_requirements.append(requirements)
+        return all_requirements
+
+    # 加载的物品、公式和编译后的公式图各自占用的内存（字节），process为整个进程占用的物理内存
+    def memory_report(self):
+        seen = set()
+        things = deep_sizeof(list(self._all_things.values()), seen, (Formula,))
+        formulas = deep_sizeof(self._all_formulas, seen, (Thing,))
+        graph = deep_sizeof(self._graph, seen, (Thing, Formula)) if self._graph else 0
+        return {
+            'things': things,
+            'formulas': formulas,
+            'graph': graph,
+            'total': things + formulas + graph,
+            'process': process_memory(),
+        }
+
+    # 快照中不保存计算结果的缓存
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_requirement_cache'] = OrderedDict()
+        state['_solutions'] = OrderedDict()
+        del state['_cache_lock']
+        return state
+
+    # 缓存和锁总是重新创建，旧快照中缺少这些属性时也能得到完整的对象
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._requirement_cache = OrderedDict()
+        self._solutions = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    # 加载物品和公式，优先使用快照。快照中记录了程序的指纹和数据文件的修改时间、大小和内容哈希，
+    # 修改时间或大小不同时再比较哈希，程序或数据文件有变化时重新加载并写入新的快照
+    # snapshot默认为数据文件夹旁边的Cache/ThingsMgr.snapshot
+    @classmethod
+    def load(cls, folder=FILES_FOLDER, snapshot=None):
+        if snapshot is None:
+            snapshot = os.path.join(os.path.dirname(os.path.abspath(folder)), CACHE_FOLDER, SNAPSHOT_FILE)
+
+        mgr = cls.read_snapshot(folder, snapshot)
+        if mgr is None:
+            mgr = cls._inst = cls()
+            # 必须先加载物品再加载公式
+            mgr.load_things(folder)
+            mgr.load_formulas(folder)
+            mgr.write_snapshot(folder, snapshot)
+        cls._inst = mgr
+        return mgr
+
+    @staticmethod
+    def files_state(folder, known=None):
+        state = {}
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            if known and name in known and known[name][:2] == (stat.st_mtime_ns, stat.st_size):
+                state[name] = known[name]
+                continue
+            with open(path, 'rb') as file:
+                state[name] = (stat.st_mtime_ns, stat.st_size, hashlib.sha256(file.read()).hexdigest())
+        return state
+
+    # 程序的指纹，打包后为可执行文件的修改时间和大小，否则为本文件内容的哈希，程序更新后旧快照不再使用
+    @staticmethod
+    def code_fingerprint():
+        if getattr(sys, 'frozen', False):
+            stat = os.stat(sys.executable)
+            return 'exe', stat.st_mtime_ns, stat.st_size
+        with open(os.path.abspath(__file__), 'rb') as file:
+            return 'source', hashlib.sha256(file.read()).hexdigest()
+
+    @classmethod
+    def read_snapshot(cls, folder, snapshot):
+        try:
+            with open(snapshot, 'rb') as file:
+                version, code, files = pickle.load(file)
+                if version != SNAPSHOT_VERSION or code != cls.code_fingerprint():
+                    return None
+                state = cls.files_state(folder, files)
+                if {name: data[2] for name, data in state.items()} != {name: data[2] for name, data in files.items()}:
+                    return None
+                mgr = pickle.load(file)
+        except Exception:
+            return None
+
+        # 只有修改时间变化时更新快照中记录的文件状态，下次启动不用再计算哈希
+        if state != files:
+            mgr.write_snapshot(folder, snapshot, state)
+        return mgr if isinstance(mgr, cls) else None
+
+    # 先写入同一文件夹中名称唯一的临时文件再替换，多个进程同时写入时不会互相覆盖或删除对方的临时文件
+    def write_snapshot(self, folder, snapshot, state=None):
+        if state is None:
+            state = self.files_state(folder)
+        snapshot_folder = os.path.dirname(os.path.abspath(snapshot))
+        temp = None
+        try:
+            os.makedirs(snapshot_folder, exist_ok=True)
+            handle, temp = tempfile.mkstemp(prefix=os.path.basename(snapshot) + '.', suffix='.tmp', dir=snapshot_folder)
+            with os.fdopen(handle, 'wb') as file:
+                pickle.dump((SNAPSHOT_VERSION, self.code_fingerprint(), state), file, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(self, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, snapshot)
+        except (OSError, pickle.PicklingError, RecursionError):
+            if temp and os.path.exists(temp):
+                os.remove(temp)
+
+    @classmethod
+    def inst(cls):
+        if cls._inst is None:
+            cls._inst = cls()
+        return cls._inst
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 把Pictures文件夹中的图片打包成一个文件，运行时通过mmap读取，不需要逐个打开图片文件
+# 用法：python DSPPack.py [图片文件夹] [输出文件]
+# 文件格式：8字节标识 + 4字节索引长度 + JSON索引{名称: [偏移, 长度]} + 各图片的原始PNG数据
+# 图片文件夹中的文件名称或大小与索引不一致时不再使用图片包；不比较修改时间，复制或检出文件时修改时间会变化
+# 打包成可执行文件后图片包随程序发布（见pyinstaller_main.bat），从程序的解压目录读取，不再检查
+
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+
+PICTURES_FOLDER = 'Pictures'
+PICTURES_BUNDLE = 'Pictures.pack'
+BUNDLE_MAGIC = b'DSPPACK3'
+HEADER = struct.Struct('<8sI')
+
+
+# 图片文件夹中各文件的{名称: 大小}
+def folder_state(folder):
+    state = {}
+    for entry in os.scandir(folder):
+        if entry.is_file():
+            state[entry.name] = entry.stat().st_size
+    return state
+
+
+# 打包成可执行文件后，随程序发布的文件解压在sys._MEIPASS中
+def bundle_path(path=PICTURES_BUNDLE):
+    if getattr(sys, 'frozen', False) and not os.path.isabs(path):
+        return os.path.join(getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(sys.executable))), path)
+    return path
+
+
+def pack_pictures(folder=PICTURES_FOLDER, output=PICTURES_BUNDLE):
+    names = sorted(folder_state(folder))
+    blobs = []
+    for name in names:
+        with open(os.path.join(folder, name), 'rb') as file:
+            blobs.append(file.read())
+
+    # 索引中的偏移从数据区开始计算，因此索引的长度不影响偏移
+    index = {}
+    offset = 0
+    for name, blob in zip(names, blobs):
+        index[name] = [offset, len(blob)]
+        offset += len(blob)
+    index_data = json.dumps(index, ensure_ascii=False).encode('utf-8')
+
+    # 先写入同一文件夹中名称唯一的临时文件再替换，同时打包时不会互相覆盖
+    handle, temp = tempfile.mkstemp(prefix=os.path.basename(output) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(os.path.abspath(output)))
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            file.write(HEADER.pack(BUNDLE_MAGIC, len(index_data)))
+            file.write(index_data)
+            for blob in blobs:
+                file.write(blob)
+        os.replace(temp, output)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return len(names), HEADER.size + len(index_data) + offset
+
+
+class PictureBundle(object):
+    def __init__(self, path=PICTURES_BUNDLE):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, index_size = HEADER.unpack_from(self._map, 0)
+            if magic != BUNDLE_MAGIC:
+                raise ValueError('不是图片包文件：%s' % path)
+            start = HEADER.size + index_size
+            self._index = {}
+            for name, (offset, length) in json.loads(self._map[HEADER.size:start].decode('utf-8')).items():
+                self._index[name] = (start + offset, length)
+        except Exception:
+            self._file.close()
+            raise
+        self._view = memoryview(self._map)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def names(self):
+        return list(self._index)
+
+    # 图片文件夹与打包时相同：文件名称相同，大小都没有变化
+    def matches(self, folder):
+        return folder_state(folder) == {name: length for name, (offset, length) in self._index.items()}
+
+    # 返回图片数据的memoryview，不复制数据，图片不存在时返回None
+    def data(self, name):
+        item = self._index.get(name)
+        if item is None:
+            return None
+        offset, length = item
+        return self._view[offset:offset + length]
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    # 图片包不存在、损坏或与图片文件夹folder不一致时返回None，此时使用图片文件夹中的文件
+    # 没有图片文件夹或已打包成可执行文件时直接使用图片包
+    @classmethod
+    def open(cls, path=PICTURES_BUNDLE, folder=PICTURES_FOLDER):
+        path = bundle_path(path)
+        if getattr(sys, 'frozen', False):
+            folder = None
+        if not os.path.isfile(path):
+            return None
+        try:
+            bundle = cls(path)
+        except (OSError, ValueError, TypeError, struct.error):
+            return None
+        try:
+            stale = folder is not None and os.path.isdir(folder) and not bundle.matches(folder)
+        except OSError:
+            stale = True
+        if stale:
+            bundle.close()
+            return None
+        return bundle
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else PICTURES_FOLDER
+    output = sys.argv[2] if len(sys.argv) > 2 else PICTURES_BUNDLE
+    count, size = pack_pictures(folder, output)
+    print('%d pictures packed into %s (%d bytes)' % (count, output, size))
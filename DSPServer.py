@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 本地JSON-RPC 2.0计算服务，只使用标准库asyncio，不导入PyQt5
+# 每个请求和响应占一行JSON，同一连接上可以连续发送多个请求，响应按请求顺序返回
+# 用法：python DSPServer.py --port 8765
+# 请求：{"jsonrpc": "2.0", "id": 1, "method": "calculate",
+#        "params": {"target": "宇宙矩阵", "speed": 60, "mineral_level": 2,
+#                   "facilities": {"assembler": "制造台MK.III"}, "formulas": {"精炼油": 1}}}
+# 工厂规划：{"jsonrpc": "2.0", "id": 2, "method": "plan", "params": {"targets": {"电磁矩阵": 60, "能量矩阵": 60}}}
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+from collections import OrderedDict
+
+from DSPCore import FILES_FOLDER, ThingsMgr
+
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super(RpcError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+class CalculateServer(object):
+    settings_cache_size = 256
+    write_buffer_limit = 64 * 1024
+    line_limit = 1024 * 1024        # 一行请求的最大长度
+
+    def __init__(self, mgr):
+        self._mgr = mgr
+        self._graph = mgr.graph()
+        self._default_settings = self._graph.current_settings()
+        self._settings_cache = OrderedDict()     # {请求中设置的JSON: RecipeGraph.make_settings的结果}
+        self._methods = {
+            'calculate': self.calculate,
+            'plan': self.plan,
+            'things': self.things,
+            'settings': self.settings,
+            'ping': self.ping,
+        }
+
+    def get_settings(self, params):
+        data = {key: params.get(key) for key in ('mineral_level', 'facilities', 'formulas')}
+        key = json.dumps(data, sort_keys=True, ensure_ascii=False)
+        settings = self._settings_cache.get(key)
+        if settings is None:
+            settings = self._graph.make_settings(base=self._default_settings, **data)
+            self._settings_cache[key] = settings
+            if len(self._settings_cache) > self.settings_cache_size:
+                self._settings_cache.popitem(last=False)
+        else:
+            self._settings_cache.move_to_end(key)
+        return settings
+
+    # 每分钟产量必须是有限的非负数，NaN和无穷大无法输出为合法的JSON
+    @staticmethod
+    def parse_speed(name, value):
+        try:
+            speed = float(value)
+        except (TypeError, ValueError):
+            raise RpcError(INVALID_PARAMS, '%s的产量不是数字：%s' % (name, value))
+        if not math.isfinite(speed) or speed < 0:
+            raise RpcError(INVALID_PARAMS, '%s的产量应为有限的非负数：%s' % (name, value))
+        return speed
+
+    def calculate(self, params):
+        thing = self._mgr.all_things().get(params.get('target'))
+        if thing is None:
+            raise RpcError(INVALID_PARAMS, '未知的物品：%s' % params.get('target'))
+        speed = self.parse_speed(thing.name, params.get('speed', 60))
+        summary = self._mgr.calcu_summary(thing, speed, params.get('backend'), self.get_settings(params))
+        if summary is None:
+            raise RpcError(INVALID_PARAMS, '%s没有合成公式' % thing.name)
+        return summary
+
+    def plan(self, params):
+        targets = params.get('targets')
+        if not isinstance(targets, dict):
+            raise RpcError(INVALID_PARAMS, 'targets应为{物品名称: 每分钟产量}')
+        targets = {name: self.parse_speed(name, speed) for name, speed in targets.items()}
+        return self._mgr.calcu_plan_summary(targets, params.get('backend'), self.get_settings(params))
+
+    def things(self, params):
+        return [name for name, thing in self._mgr.all_things().items() if thing.product_formulas()]
+
+    def settings(self, params):
+        selected, facilities, mineral_level = self.get_settings(params)
+        return {
+            'mineral_level': mineral_level,
+            'facilities': {facility_type: self._graph.names[facility] for facility_type, facility in facilities.items()},
+        }
+
+    def ping(self, params):
+        return 'pong'
+
+    def handle_request(self, request):
+        request_id = None
+        try:
+            if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' or 'method' not in request:
+                raise RpcError(INVALID_REQUEST, '无效的请求')
+            request_id = request.get('id')
+            method = self._methods.get(request['method'])
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, '未知的方法：%s' % request['method'])
+            params = request.get('params') or {}
+            if not isinstance(params, dict):
+                raise RpcError(INVALID_PARAMS, 'params应为对象')
+            response = {'jsonrpc': '2.0', 'id': request_id, 'result': method(params)}
+        except RpcError as error:
+            response = {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': error.code, 'message': error.message}}
+        except (ValueError, TypeError, KeyError) as error:
+            response = {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': INVALID_PARAMS, 'message': str(error)}}
+        except Exception as error:
+            response = {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': INTERNAL_ERROR, 'message': repr(error)}}
+
+        if isinstance(request, dict) and 'method' in request and 'id' not in request:
+            return None     # 通知不需要响应
+        return response
+
+    def handle_line(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {'jsonrpc': '2.0', 'id': None, 'error': {'code': PARSE_ERROR, 'message': '无法解析JSON'}}
+
+        if isinstance(request, list):
+            if not request:
+                return {'jsonrpc': '2.0', 'id': None, 'error': {'code': INVALID_REQUEST, 'message': '空的批量请求'}}
+            responses = [self.handle_request(item) for item in request]
+            return [response for response in responses if response is not None] or None
+        return self.handle_request(request)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # 请求超过line_limit时无法找到下一行的开始，返回错误后关闭连接
+                    error = {'jsonrpc': '2.0', 'id': None, 'error': {'code': INVALID_REQUEST, 'message': '请求过长'}}
+                    writer.write(json.dumps(error, ensure_ascii=False).encode('utf-8') + b'\n')
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                response = self.handle_line(line)
+                if response is not None:
+                    writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                # 连续收到的请求一起写出，缓冲区较大时才等待发送
+                if writer.transport.get_write_buffer_size() > self.write_buffer_limit:
+                    await writer.drain()
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=self.line_limit)
+        print('DSP calculate server listening on %s:%d' % (host, port), file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='戴森球计划生产需求计算服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址，默认只接受本机连接')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--files-folder', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), FILES_FOLDER),
+                        help='数据文件所在的文件夹')
+    args = parser.parse_args(argv)
+
+    mgr = ThingsMgr.load(args.files_folder)
+    try:
+        asyncio.run(CalculateServer(mgr).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
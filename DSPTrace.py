@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 性能追踪，环境变量DSP_TRACE为输出文件路径时记录各阶段的耗时，
+# 程序退出时写出Chrome trace-event格式的JSON，可以在chrome://tracing或Perfetto中打开
+# 用法：DSP_TRACE=trace.json python DSP.py
+# 没有设置环境变量时span返回共用的空上下文管理器，traced直接返回原函数，几乎没有额外开销
+# 界面阻塞检测：DSP_STALL=200 python DSP.py，主线程超过200毫秒没有响应时记录主线程的调用栈和阻塞时长，
+# 日志默认输出到标准错误，没有标准错误时（用-w打包的程序）写入程序旁边的Cache/stall.log，DSP_STALL_LOG可以指定日志文件
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+
+TRACE_ENV = 'DSP_TRACE'
+STALL_ENV = 'DSP_STALL'
+STALL_LOG_ENV = 'DSP_STALL_LOG'
+CACHE_FOLDER = 'Cache'
+STALL_LOG_FILE = 'stall.log'
+
+
+# 程序旁边的Cache文件夹中的文件，打包后为可执行文件所在的文件夹，否则为源代码所在的文件夹
+def cache_path(name):
+    if getattr(sys, 'frozen', False):
+        folder = os.path.dirname(os.path.abspath(sys.executable))
+    else:
+        folder = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(folder, CACHE_FOLDER, name)
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+    # 在span结束前补充参数，例如是否命中缓存
+    def set(self, **args):
+        self.args.update(args)
+
+
+class Tracer(object):
+    _inst = None
+
+    def __init__(self, path=None):
+        self.path = os.path.abspath(path) if path else None
+        self.enabled = bool(path)
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._events = []       # 在多个线程中追加，list.append是原子操作，不需要加锁
+        self._threads = {}      # {线程编号: 线程名称}
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def add(self, name, start, end, args):
+        thread = threading.get_ident()
+        if thread not in self._threads:
+            self._threads[thread] = threading.current_thread().name
+        event = {'name': name, 'ph': 'X', 'pid': self._pid, 'tid': thread,
+                 'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6}
+        if args:
+            event['args'] = args
+        self._events.append(event)
+
+    # 线程名称的元数据事件加上所有已结束的span，时间单位为微秒
+    def events(self):
+        threads = [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': thread, 'args': {'name': name}}
+                   for thread, name in list(self._threads.items())]
+        return threads + list(self._events)
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        temp = path + '.tmp'
+        try:
+            with open(temp, 'w', encoding='utf-8') as file:
+                json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, file, ensure_ascii=False)
+            os.replace(temp, path)
+        except (OSError, TypeError, ValueError):
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    @classmethod
+    def inst(cls):
+        if cls._inst is None:
+            cls._inst = cls(os.environ.get(TRACE_ENV))
+            if cls._inst.enabled:
+                atexit.register(cls._inst.save)
+        return cls._inst
+
+
+def span(name, **args):
+    return Tracer.inst().span(name, **args)
+
+
+# 装饰器，记录函数每次调用的耗时，name默认为函数的限定名称；没有开启追踪时返回原函数
+def traced(name=None):
+    def decorator(func):
+        if not Tracer.inst().enabled:
+            return func
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Tracer.inst().span(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# 主线程阻塞检测，主线程通过beat报告仍在运行，检测线程发现超过threshold秒没有报告时抓取主线程的调用栈，
+# 主线程恢复后把调用栈和阻塞时长写入日志。主线程在没有释放GIL的C++调用中阻塞时，检测线程要等调用返回后
+# 才能运行，此时抓到的调用栈是阻塞结束后的位置
+class StallWatchdog(object):
+    default_threshold = 200     # 毫秒
+
+    def __init__(self, threshold=default_threshold, log=None, thread_id=None):
+        self.threshold = threshold / 1000.0
+        self.beat_interval = int(min(max(threshold / 4, 10), 100))     # 主线程报告的间隔（毫秒）
+        self.log = os.path.abspath(log) if log else None
+        self.stalls = 0
+        self._thread_id = thread_id or threading.main_thread().ident
+        self._beat = time.perf_counter()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self.run, name='stall_watchdog', daemon=True)
+
+    def beat(self):
+        self._beat = time.perf_counter()
+
+    def start(self):
+        self.beat()
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._worker.is_alive():
+            self._worker.join()
+
+    def run(self):
+        stall = None    # (开始阻塞时最后一次报告的时间, 调用栈)
+        while not self._stop.wait(self.beat_interval / 1000.0):
+            beat = self._beat
+            if stall is not None and beat != stall[0]:
+                self.write(beat - stall[0], stall[1])
+                stall = None
+            if stall is None and time.perf_counter() - beat > self.threshold:
+                frame = sys._current_frames().get(self._thread_id)
+                stall = (beat, traceback.format_stack(frame) if frame is not None else [])
+        if stall is not None:
+            self.write(time.perf_counter() - stall[0], stall[1], True)
+
+    def write(self, duration, stack, unfinished=False):
+        self.stalls += 1
+        lines = ['%s 主线程阻塞%s %d ms\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), '至少' if unfinished else '',
+                                              duration * 1000)]
+        lines.extend(stack)
+        stream = sys.stderr
+        log = self.log or (None if stream is not None else cache_path(STALL_LOG_FILE))
+        # 写入失败时放弃这条记录，检测线程继续运行
+        try:
+            if log:
+                os.makedirs(os.path.dirname(log), exist_ok=True)
+                with open(log, 'a', encoding='utf-8') as file:
+                    file.writelines(lines)
+            else:
+                stream.writelines(lines)
+                stream.flush()
+        except Exception:
+            pass
+
+    # 没有设置DSP_STALL时返回None，值不是数字时使用默认阈值
+    @classmethod
+    def from_env(cls):
+        value = os.environ.get(STALL_ENV)
+        if not value:
+            return None
+        try:
+            threshold = max(float(value), 1)
+        except ValueError:
+            threshold = cls.default_threshold
+        return cls(threshold, os.environ.get(STALL_LOG_ENV))
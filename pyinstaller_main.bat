@@ -1,3 +1,4 @@
-pyinstaller -F -w --paths=D:\Python36\Lib\site-packages\PyQt5\Qt\bin --paths=D:\Python36\Lib\site-packages\PyQt5\Qt\plugins --icon=DSPLOGO-32.ico DSP.py
+python DSPPack.py
+pyinstaller -F -w --paths=D:\Python36\Lib\site-packages\PyQt5\Qt\bin --paths=D:\Python36\Lib\site-packages\PyQt5\Qt\plugins --add-data=Pictures.pack;. --icon=DSPLOGO-32.ico DSP.py
 
 pause
\ No newline at end of file
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from DSPCore import FILES_FOLDER, ThingsMgr, load_numpy
+
+
+FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), FILES_FOLDER)
+
+
+# 所有测试共用一份从数据文件加载的ThingsMgr，不读写快照
+def load_mgr():
+    mgr = ThingsMgr.inst()
+    if mgr.graph() is None:
+        mgr.load_things(FILES)
+        mgr.load_formulas(FILES)
+    return mgr
+
+
+def has_numpy():
+    try:
+        load_numpy('测试')
+    except RuntimeError:
+        return False
+    return True
+
+
+# 比较{名称: 数量}，数量为0的项目视为不存在
+def assert_counts_equal(test, first, second, message=None):
+    names = {name for name, count in first.items() if abs(count) > 1e-9} | \
+        {name for name, count in second.items() if abs(count) > 1e-9}
+    for name in names:
+        test.assertAlmostEqual(first.get(name, 0), second.get(name, 0), delta=1e-6 * max(1, abs(first.get(name, 0))),
+                               msg='%s %s' % (message or '', name))
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from tests import assert_counts_equal, has_numpy, load_mgr
+
+
+@unittest.skipUnless(has_numpy(), '批量计算需要numpy')
+class BatchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mgr = load_mgr()
+        cls.graph = cls.mgr.graph()
+
+    # 所有目标一起批量计算，第i个计划只生产第i个目标，与逐个调用calcu_requirements的结果相同
+    def check_all_targets(self, settings, speed=60):
+        graph = self.graph
+        things = [thing for thing in self.mgr.all_things().values() if settings[0][thing.id] >= 0]
+        rates = [[speed if col == row else 0 for col in range(len(things))] for row in range(len(things))]
+        demands, facilities, powers = graph.solve_batch([thing.id for thing in things], rates, settings)
+
+        for row, thing in enumerate(things):
+            final = self.mgr.calcu_requirements(thing, speed, 'topological', settings)[0][-1]
+            expected_facilities = {}
+            for name, count in final.facilities():
+                expected_facilities[name] = expected_facilities.get(name, 0) + count
+            batch_facilities = {graph.names[item]: count for item, count in enumerate(facilities[row]) if count}
+            assert_counts_equal(self, batch_facilities, expected_facilities, thing.name)
+
+            # 不展开的物品为原料；不展开的目标只计算一次，它的原料都是原料，目标本身由公式生产，不计入原料
+            root = graph.expand_index(thing.id, settings) < 0
+            materials = {}
+            for item, count in enumerate(demands[row]):
+                if count and (root or graph.expand_index(item, settings) < 0):
+                    materials[graph.names[item]] = count - (speed if item == thing.id else 0)
+            assert_counts_equal(self, materials, final.materials(), thing.name)
+            self.assertAlmostEqual(powers[row], final.work_consumption(), delta=1e-6 * max(1, powers[row]),
+                                   msg=thing.name)
+
+    def test_default_settings(self):
+        self.check_all_targets(self.graph.current_settings())
+
+    def test_alternative_formulas(self):
+        formulas = {thing.name: 1 for thing in self.mgr.get_multi_formula_things()}
+        self.check_all_targets(self.graph.make_settings(formulas=formulas, mineral_level=3))
+
+    def test_excluded_targets(self):
+        graph = self.graph
+        settings = graph.current_settings()
+        names = ['重氢', '氢', '铁矿', '电路板']
+        demands, facilities, powers = self.mgr.calcu_batch_requirements(names, [[60, 30, 20, 10], [0, 0, 0, 0]])
+        expected = {}
+        for name, speed in zip(names, (60, 30, 20, 10)):
+            for facility, count in self.mgr.calcu_requirements(self.mgr.get_thing(name), speed,
+                                                                'topological', settings)[0][-1].facilities():
+                expected[facility] = expected.get(facility, 0) + count
+        assert_counts_equal(self, {graph.names[item]: count for item, count in enumerate(facilities[0]) if count},
+                            expected)
+        self.assertFalse(facilities[1].any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import io
+import unittest
+
+from DSPCli import parse_args, parse_plan
+
+
+class CliTest(unittest.TestCase):
+    def parse_error(self, argv):
+        with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit) as context:
+            parse_args(argv)
+        self.assertEqual(context.exception.code, 2, argv)
+
+    def test_speed(self):
+        self.assertEqual(parse_args(['电路板', '30'])[1].speed, 30)
+        self.assertEqual(parse_args(['电路板', '0'])[1].speed, 0)
+        for speed in ('nan', 'inf', '-inf', '-5', 'abc'):
+            self.parse_error(['电路板', '--', speed] if speed.startswith('-') else ['电路板', speed])
+
+    def test_mineral_level(self):
+        self.assertEqual(parse_args(['铁矿', '--mineral-level', '3'])[1].mineral_level, 3)
+        for level in ('-10', '1.5', 'abc'):
+            self.parse_error(['铁矿', '--mineral-level', level])
+
+    def test_plan_entries(self):
+        self.assertEqual(parse_plan({'target': '电路板'}), ('电路板', 60))
+        self.assertEqual(parse_plan({'target': '电路板', 'speed': '30'}), ('电路板', 30))
+        for plan in ({'speed': 5}, {'target': ['电路板']}, {'target': '电路板', 'speed': 'nan'},
+                     {'target': '电路板', 'speed': -1}, {'target': '电路板', 'speed': None}, ['电路板', 60], 7):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_plan(plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+from DSPCore import MatrixSolver
+from tests import assert_counts_equal, has_numpy, load_mgr
+from tests.test_solver import random_settings
+
+
+@unittest.skipUnless(has_numpy(), '矩阵求解需要numpy')
+class MatrixTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mgr = load_mgr()
+        cls.graph = cls.mgr.graph()
+        cls.solver = MatrixSolver(cls.graph)
+
+    # 宇宙矩阵的生产链中有产出氢的副产物，矩阵求解时抵扣需要的氢，其余原料和耗电不变
+    def test_byproducts_netted(self):
+        thing = self.mgr.get_thing('宇宙矩阵')
+        settings = self.graph.make_settings()
+        topological = self.mgr.calcu_summary(thing, 60, 'topological', settings)
+        matrix = self.mgr.calcu_summary(thing, 60, 'matrix', settings)
+        self.assertAlmostEqual(topological['materials']['氢'], 840)
+        self.assertAlmostEqual(matrix['materials']['氢'], 262.5)
+        del topological['materials']['氢'], matrix['materials']['氢']
+        assert_counts_equal(self, topological['materials'], matrix['materials'])
+        self.assertAlmostEqual(topological['work_consumption'], matrix['work_consumption'])
+
+    # 有公式的物品净产出不能小于0，即没有未满足的需求
+    def test_no_unmet_demand(self):
+        graph = self.graph
+        generator = random.Random(3)
+        for settings in [graph.make_settings()] + [random_settings(self.mgr, generator) for i in range(5)]:
+            for thing in self.mgr.all_things().values():
+                if settings[0][thing.id] < 0:
+                    continue
+                demands, roots = graph.expand_targets({thing.id: 60.0}, settings)
+                if not demands:
+                    continue
+                items, columns, rates, net = self.solver.solve(demands, settings)
+                self.assertTrue((rates >= 0).all(), thing.name)
+                for row, item in enumerate(items):
+                    if graph.expand_index(item, settings) >= 0:
+                        self.assertGreater(net[row], -1e-6, '%s %s' % (thing.name, graph.names[item]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from DSPPack import PictureBundle, pack_pictures
+
+
+class PackTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.pictures = os.path.join(self.folder, 'Pictures')
+        os.mkdir(self.pictures)
+        for name, data in (('a.png', b'aaaa'), ('b.png', b'bb')):
+            with open(os.path.join(self.pictures, name), 'wb') as file:
+                file.write(data)
+        self.pack = os.path.join(self.folder, 'Pictures.pack')
+        pack_pictures(self.pictures, self.pack)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def open(self, folder=None):
+        bundle = PictureBundle.open(self.pack, folder or self.pictures)
+        if bundle is not None:
+            self.addCleanup(bundle.close)
+        return bundle
+
+    def test_open(self):
+        bundle = self.open()
+        self.assertEqual(sorted(bundle.names()), ['a.png', 'b.png'])
+        self.assertEqual(bytes(bundle.data('a.png')), b'aaaa')
+        self.assertIsNone(bundle.data('c.png'))
+        # 打包时的临时文件已替换为图片包
+        self.assertEqual(sorted(os.listdir(self.folder)), ['Pictures', 'Pictures.pack'])
+
+    # 只有修改时间变化（如复制或检出文件）时仍然使用图片包
+    def test_touched_folder(self):
+        os.utime(os.path.join(self.pictures, 'a.png'), (0, 0))
+        self.assertIsNotNone(self.open())
+
+    def test_stale_size(self):
+        with open(os.path.join(self.pictures, 'a.png'), 'ab') as file:
+            file.write(b'a')
+        self.assertIsNone(self.open())
+
+    def test_stale_names(self):
+        os.rename(os.path.join(self.pictures, 'b.png'), os.path.join(self.pictures, 'c.png'))
+        self.assertIsNone(self.open())
+        with open(os.path.join(self.pictures, 'b.png'), 'wb') as file:
+            file.write(b'bb')
+        self.assertIsNone(self.open())
+
+    def test_missing_folder(self):
+        shutil.rmtree(self.pictures)
+        self.assertIsNotNone(self.open())
+
+    # 打包成可执行文件后从解压目录读取，不检查图片文件夹
+    def test_frozen(self):
+        with open(os.path.join(self.pictures, 'a.png'), 'ab') as file:
+            file.write(b'a')
+        with mock.patch.object(sys, 'frozen', True, create=True), \
+                mock.patch.object(sys, '_MEIPASS', self.folder, create=True):
+            bundle = PictureBundle.open('Pictures.pack', self.pictures)
+        self.assertIsNotNone(bundle)
+        self.addCleanup(bundle.close)
+        self.assertEqual(bytes(bundle.data('b.png')), b'bb')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from DSPCore import ThingsMgr
+from tests import assert_counts_equal, has_numpy, load_mgr
+
+
+class PlanTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mgr = load_mgr()
+        cls.graph = cls.mgr.graph()
+        cls.backends = ThingsMgr.backends if has_numpy() else ('topological',)
+
+    # 只有一个目标的工厂规划与calcu_requirements的结果相同，包括排除的物品和原矿
+    def check_single_targets(self, settings):
+        for thing in self.mgr.all_things().values():
+            if settings[0][thing.id] < 0:
+                continue
+            for backend in self.backends:
+                message = '%s %s' % (thing.name, backend)
+                try:
+                    single = self.mgr.calcu_summary(thing, 60, backend, settings)
+                except ValueError:
+                    with self.assertRaises(ValueError):
+                        self.mgr.calcu_plan_summary({thing.name: 60}, backend, settings)
+                    continue
+                plan = self.mgr.calcu_plan_summary({thing.name: 60}, backend, settings)
+                for key in ('materials', 'facilities', 'byproducts', 'products'):
+                    assert_counts_equal(self, plan[key], single[key], '%s %s' % (message, key))
+                self.assertAlmostEqual(plan['work_consumption'], single['work_consumption'], places=6, msg=message)
+
+    def test_single_target_default_settings(self):
+        self.check_single_targets(self.graph.current_settings())
+
+    def test_single_target_alternative_formulas(self):
+        formulas = {thing.name: 1 for thing in self.mgr.get_multi_formula_things()}
+        self.check_single_targets(self.graph.make_settings(formulas=formulas))
+
+    def test_excluded_targets(self):
+        for name in ('重氢', '氢', '铁矿'):
+            for backend in self.backends:
+                summary = self.mgr.calcu_plan_summary({name: 60}, backend)
+                self.assertNotIn(None, summary['products'])
+                self.assertEqual(summary['products'].get(name), 60)
+                self.assertTrue(summary['facilities'])
+
+    # 不展开的目标只按所选公式计算一次，原料即使可以展开也作为原料，单个产物的计算和工厂规划相同
+    def test_excluded_target_materials_stay_raw(self):
+        settings = self.graph.make_settings(formulas={'氢': '（公式）X射线裂解'})
+        for backend in self.backends:
+            for summary in (self.mgr.calcu_summary(self.mgr.get_thing('氢'), 60, backend, settings),
+                            self.mgr.calcu_plan_summary({'氢': 60}, backend, settings)):
+                assert_counts_equal(self, summary['materials'], {'精炼油': 20, '氢': 40}, backend)
+                assert_counts_equal(self, summary['facilities'], {'原油精炼厂': 4 / 3}, backend)
+                self.assertAlmostEqual(summary['work_consumption'], 1280, msg=backend)
+
+    # 排除的目标在其他公式中作为原料时仍是原料
+    def test_excluded_target_with_consumer(self):
+        settings = self.graph.make_settings(formulas={'氢': 1})
+        summary = self.mgr.calcu_plan_summary({'氢': 60, '卡西米尔晶体': 60}, 'topological', settings)
+        hydrogen = self.mgr.calcu_summary(self.mgr.get_thing('氢'), 60, 'topological', settings)
+        crystal = self.mgr.calcu_summary(self.mgr.get_thing('卡西米尔晶体'), 60, 'topological', settings)
+        for key in ('materials', 'facilities'):
+            total = dict(hydrogen[key])
+            for name, count in crystal[key].items():
+                total[name] = total.get(name, 0) + count
+            assert_counts_equal(self, summary[key], total, key)
+
+
+if __name__ == '__main__':
+    unittest.main()
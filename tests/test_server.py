@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import unittest
+
+from DSPServer import INVALID_PARAMS, INVALID_REQUEST, CalculateServer
+from tests import load_mgr
+
+
+class ServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = CalculateServer(load_mgr())
+
+    def call(self, method, params):
+        line = json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params}, ensure_ascii=False)
+        response = self.server.handle_line(line)
+        # 响应必须是合法的JSON，不能包含NaN或Infinity
+        json.dumps(response, allow_nan=False)
+        return response
+
+    def test_calculate(self):
+        response = self.call('calculate', {'target': '电路板', 'speed': 60})
+        self.assertEqual(response['result']['materials'], {'铁矿': 60, '铜矿': 30})
+
+    def test_calculate_invalid_speed(self):
+        for speed in ('nan', 'inf', '-inf', -1, 'abc', None, [60]):
+            response = self.call('calculate', {'target': '电路板', 'speed': speed})
+            self.assertEqual(response['error']['code'], INVALID_PARAMS, speed)
+
+    def test_calculate_zero_speed(self):
+        response = self.call('calculate', {'target': '电路板', 'speed': '0'})
+        self.assertEqual(response['result']['speed'], 0)
+
+    def test_plan(self):
+        response = self.call('plan', {'targets': {'电磁矩阵': 60, '能量矩阵': '30'}})
+        self.assertEqual(response['result']['products']['电磁矩阵'], 60)
+        self.assertEqual(response['result']['products']['能量矩阵'], 30)
+
+    def test_plan_invalid_speed(self):
+        for speed in ('nan', 'inf', -60, 'abc', None):
+            response = self.call('plan', {'targets': {'电磁矩阵': 60, '能量矩阵': speed}})
+            self.assertEqual(response['error']['code'], INVALID_PARAMS, speed)
+
+    # 设置错误是客户端的问题，返回INVALID_PARAMS而不是INTERNAL_ERROR
+    def test_invalid_settings(self):
+        for params in ({'mineral_level': -10}, {'mineral_level': 2.5}, {'mineral_level': 'abc'},
+                       {'mineral_level': True}, {'formulas': ['精炼油', 1]}, {'facilities': 'assembler'},
+                       {'facilities': {'assembler': '电路板'}}, {'formulas': {'精炼油': 9}}):
+            params.update(target='电路板', speed=60)
+            response = self.call('calculate', params)
+            self.assertEqual(response['error']['code'], INVALID_PARAMS, params)
+            params.pop('target')
+            response = self.call('plan', dict(params, targets={'电路板': 60}))
+            self.assertEqual(response['error']['code'], INVALID_PARAMS, params)
+
+    def test_mineral_level(self):
+        for level in (3, '3'):
+            response = self.call('settings', {'mineral_level': level})
+            self.assertEqual(response['result']['mineral_level'], 3)
+
+    # 超过长度限制的请求返回错误并关闭连接，之前的请求正常响应
+    def test_line_too_long(self):
+        async def run():
+            server = await asyncio.start_server(self.server.handle_connection, '127.0.0.1', 0,
+                                                limit=self.server.line_limit)
+            async with server:
+                port = server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(b'{"jsonrpc": "2.0", "id": 1, "method": "ping"}\n')
+                writer.write(b'[' + b' ' * (self.server.line_limit + 10) + b']\n')
+                await writer.drain()
+                lines = [json.loads(line) for line in (await asyncio.wait_for(reader.read(), 10)).splitlines()]
+                writer.close()
+                return lines
+
+        lines = asyncio.run(run())
+        self.assertEqual(lines[0]['result'], 'pong')
+        self.assertEqual(lines[1]['error']['code'], INVALID_REQUEST)
+        self.assertEqual(len(lines), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
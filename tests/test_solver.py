@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+from DSPCore import Formula
+from tests import assert_counts_equal, has_numpy, load_mgr
+
+
+# 原来的逐层展开算法：每层的物品按所选公式展开，原料作为下一层，直到没有需要展开的物品
+# 不展开的目标只计算一次，它和它的原料都不计入。返回{物品: 总需求}
+def level_totals(graph, demands, settings):
+    level = {}
+    for item, count in demands.items():
+        if settings[0][item] < 0 or graph.expand_index(item, settings) >= 0:
+            level[item] = level.get(item, 0) + count
+
+    totals = {}
+    while level:
+        next_level = {}
+        for item, count in level.items():
+            totals[item] = totals.get(item, 0) + count
+            node = graph.calcu_node(graph.expand_index(item, settings), count, settings)
+            for material, material_count in (node[3] if node else ()):
+                next_level[material] = next_level.get(material, 0) + material_count
+        level = next_level
+    return totals
+
+
+# 随机选择每个物品的公式、每种设备类型的设备和矿物利用等级
+def random_settings(mgr, generator):
+    formulas = {thing.name: generator.randrange(len(thing.product_formulas()))
+                for thing in mgr.get_multi_formula_things()}
+    facilities = {facility_type: generator.choice(mgr.get_by_facility_type(facility_type)).name
+                  for facility_type in Formula.facility_selected}
+    return mgr.graph().make_settings(mineral_level=generator.randrange(11), facilities=facilities, formulas=formulas)
+
+
+def names(graph, totals):
+    return {graph.names[item]: count for item, count in totals.items()}
+
+
+class SolverTest(unittest.TestCase):
+    rounds = 20
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mgr = load_mgr()
+        cls.graph = cls.mgr.graph()
+        cls.products = [thing.id for thing in cls.mgr.all_things().values() if thing.product_formulas()]
+        generator = random.Random(20211)
+        cls.settings = [cls.graph.current_settings()] + \
+            [random_settings(cls.mgr, generator) for _ in range(cls.rounds)]
+
+    def has_loop(self, item, settings):
+        demands, roots = self.graph.expand_targets({item: 1.0}, settings)
+        return any(self.graph.loop_of[child] >= 0 for child in self.graph.reachable(demands, settings))
+
+    # 拓扑顺序一次求解的总需求与逐层展开的结果相同，不包含循环的产物才能逐层展开
+    def test_topological_matches_levels(self):
+        checked = 0
+        for settings in self.settings:
+            for item in self.products:
+                if self.has_loop(item, settings):
+                    continue
+                demands = {item: 60.0}
+                solution = self.graph.solve_incremental(demands, settings)
+                expected = level_totals(self.graph, demands, settings)
+                message = '%s %s' % (self.graph.names[item], settings[1:])
+                assert_counts_equal(self, names(self.graph, solution.totals), names(self.graph, expected), message)
+                checked += 1
+        self.assertGreater(checked, len(self.products) * len(self.settings) // 2)
+
+    def solve(self, demands, settings, previous=None):
+        try:
+            return self.graph.solve_incremental(demands, settings, previous)
+        except ValueError:
+            return None
+
+    def assert_solutions_equal(self, first, second, message):
+        graph = self.graph
+        self.assertEqual(first is None, second is None, message)
+        if first is None:
+            return
+        assert_counts_equal(self, names(graph, first.totals), names(graph, second.totals), message)
+        self.assertEqual(set(first.nodes), set(second.nodes), message)
+        for item, node in first.nodes.items():
+            other = second.nodes[item]
+            self.assertEqual(node is None, other is None, message)
+            if node:
+                self.assertEqual(node[:2], other[:2], '%s %s' % (message, graph.names[item]))
+                self.assertAlmostEqual(node[2], other[2], delta=1e-9 * max(1, node[2]),
+                                       msg='%s %s' % (message, graph.names[item]))
+        self.assertEqual([[item for item, count, node in level] for level in first.levels],
+                         [[item for item, count, node in level] for level in second.levels], message)
+
+    # 依次切换随机设置，在上一次结果的基础上增量求解，与完整求解和逐层展开的结果都相同
+    def test_incremental_matches_full(self):
+        reused = 0
+        for item in self.products:
+            demands = {item: 60.0}
+            previous = None
+            for settings in self.settings:
+                solution = self.solve(demands, settings, previous)
+                full = self.solve(demands, settings)
+                message = '%s %s' % (self.graph.names[item], settings[1:])
+                self.assert_solutions_equal(solution, full, message)
+                if solution is not None and not self.has_loop(item, settings):
+                    assert_counts_equal(self, names(self.graph, solution.totals),
+                                        names(self.graph, level_totals(self.graph, demands, settings)), message)
+                if solution is not None and previous is not None:
+                    reused += len(solution.nodes) - len(solution.recomputed)
+                previous = solution or previous
+        self.assertGreater(reused, 0)
+
+    # 只改变一项设置时增量求解只重新计算受影响的节点
+    def test_incremental_single_change(self):
+        graph = self.graph
+        item = graph.ids['宇宙矩阵']
+        base = graph.current_settings()
+        previous = graph.solve_incremental({item: 60.0}, base)
+        for settings in (graph.make_settings(mineral_level=5, base=base),
+                         graph.make_settings(facilities={'assembler': '制造台MK.III'}, base=base),
+                         graph.make_settings(formulas={'石墨烯': 1}, base=base)):
+            solution = graph.solve_incremental({item: 60.0}, settings, previous)
+            self.assertLess(len(solution.recomputed), len(solution.nodes))
+            self.assert_solutions_equal(solution, graph.solve_incremental({item: 60.0}, settings), str(settings[1:]))
+
+    # 每个节点的原料数量与层级一致：原料排在使用它的物品之后
+    def test_levels_order(self):
+        for settings in self.settings[:3]:
+            for item in self.products:
+                if self.has_loop(item, settings):
+                    continue
+                level_of = {}
+                for level, nodes in enumerate(self.graph.solve({item: 60.0}, settings)):
+                    for child, count, node in nodes:
+                        level_of.setdefault(child, level)
+                for level, nodes in enumerate(self.graph.solve({item: 60.0}, settings)):
+                    for child, count, node in nodes:
+                        for material, material_count in (node[3] if node else ()):
+                            self.assertGreater(level_of[material], level, self.graph.names[child])
+
+
+# 精炼油使用重整精炼时以自身为原料，构成循环
+class LoopTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mgr = load_mgr()
+        cls.graph = cls.mgr.graph()
+        cls.settings = cls.graph.make_settings(formulas={'精炼油': '（公式）重整精炼'})
+
+    def test_loop_found(self):
+        self.assertIn((self.graph.ids['精炼油'],), self.graph.loops)
+
+    # 每分钟净产出60个精炼油需要总产量180个，其中120个在循环中消耗
+    def test_refined_oil_steady_state(self):
+        item = self.graph.ids['精炼油']
+        solution = self.graph.solve_incremental({item: 60.0}, self.settings)
+        self.assertAlmostEqual(solution.totals[item], 180)
+        final = self.mgr.calcu_requirements(self.mgr.get_thing('精炼油'), 60, 'topological', self.settings)[0][-1]
+        assert_counts_equal(self, final.materials(), {'煤矿': 60, '氢': 60})
+        assert_counts_equal(self, dict(final.facilities()), {'原油精炼厂': 4})
+
+    # 没有副产物时循环的求解结果与矩阵求解相同，包括以精炼油为原料的所有产物
+    @unittest.skipUnless(has_numpy(), '矩阵求解需要numpy')
+    def test_loop_matches_matrix(self):
+        graph = self.graph
+        settings = self.settings
+        checked = 0
+        for thing in self.mgr.all_things().values():
+            if settings[0][thing.id] < 0:
+                continue
+            demands, roots = graph.expand_targets({thing.id: 1.0}, settings)
+            reached = [item for item in graph.reachable(demands, settings) if graph.expand_index(item, settings) >= 0]
+            if not any(graph.loop_of[item] >= 0 for item in reached) or \
+                    any(graph.byproducts(graph.expand_index(item, settings), 1.0) for item in reached):
+                continue
+            results = []
+            for backend in ('topological', 'matrix'):
+                final = self.mgr.calcu_requirements(thing, 60, backend, settings)[0][-1]
+                facilities = {}
+                for name, count in final.facilities():
+                    facilities[name] = facilities.get(name, 0) + count
+                results.append((final.materials(), facilities))
+            assert_counts_equal(self, results[0][0], results[1][0], thing.name)
+            assert_counts_equal(self, results[0][1], results[1][1], thing.name)
+            checked += 1
+        self.assertGreater(checked, 0)
+
+    @unittest.skipUnless(has_numpy(), '批量计算需要numpy')
+    def test_loop_batch(self):
+        item = self.graph.ids['精炼油']
+        demands, facilities, powers = self.graph.solve_batch([item], [[60], [120]], self.settings)
+        self.assertAlmostEqual(demands[0, item], 180)
+        self.assertAlmostEqual(demands[1, item], 360)
+        self.assertAlmostEqual(facilities[0, self.graph.ids['原油精炼厂']], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()